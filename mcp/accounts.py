@@ -1,15 +1,72 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import Literal
+import functools
 import json
+import random
+import sys
+import threading
+import time
 from dotenv import load_dotenv
 from datetime import datetime
-from market import get_share_price
-from database import write_account, read_account, write_log
+from market import get_share_prices, PRIORITY_TRADE
+from database import write_account, read_account_summary, read_transactions, read_transactions_page, read_portfolio_values, read_account_version, write_account_summary, write_trade, write_portfolio_value, write_log, unit_of_work, VersionConflict
+from ledger import TransactionLedger, FIELDS as TRANSACTION_FIELDS
+import async_database
 
 load_dotenv(override=True)
 
 INITIAL_BALANCE = 10_000.0
 SPREAD = 0.002
 
+# What report() includes: "summary" is the account without its history, "recent" adds the
+# last few transactions, "page" adds one page of transactions with a cursor for the next,
+# and "full" is every transaction and portfolio value. Trades answer with the compact form.
+REPORT_MODES = ("summary", "recent", "page", "full")
+COMPACT_REPORT = "recent"
+RECENT_TRANSACTIONS = 5
+REPORT_PAGE_SIZE = 50
+
+# How often to rerun a change that lost a race with another writer, and the base of the jittered backoff between tries
+MAX_CONFLICT_RETRIES = 10
+CONFLICT_BACKOFF = 0.005
+
+# One live Account per name in this process. A cached account is reused as long
+# as its version matches the database; a write from another process bumps the
+# version and the next lookup reloads it.
+_identity_map: dict[str, "Account"] = {}
+_locks: dict[str, threading.RLock] = {}
+
+
+def _account_lock(name: str) -> threading.RLock:
+    return _locks.setdefault(name.lower(), threading.RLock())
+
+
+def _exclusive(method):
+    """
+    Run an account-changing method under the account's lock.
+
+    Writes only succeed if the account is still at the version it was read at. When
+    another process got there first, reload the account and run the method again
+    from its state; if the method fails for any other reason, discard whatever it
+    changed in memory before the next caller waiting on the lock sees it.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with _account_lock(self.name):
+            for attempt in range(MAX_CONFLICT_RETRIES + 1):
+                try:
+                    return method(self, *args, **kwargs)
+                except VersionConflict:
+                    if attempt == MAX_CONFLICT_RETRIES:
+                        self._discard_changes()
+                        raise
+                    time.sleep(random.uniform(0, CONFLICT_BACKOFF * 2 ** attempt))
+                    self.refresh()
+                except Exception:
+                    self._discard_changes()
+                    raise
+    return wrapper
+
 
 class Transaction(BaseModel):
     symbol: str
@@ -25,60 +82,226 @@ class Transaction(BaseModel):
         return f"{abs(self.quantity)} shares of {self.symbol} at {self.price} each."
 
 
+class Order(BaseModel):
+    """ One leg of a basket passed to Account.execute_orders. """
+    action: Literal["buy", "sell"]
+    symbol: str
+    quantity: int = Field(gt=0)
+    rationale: str
+
+
 class Account(BaseModel):
     name: str
     balance: float
     strategy: str
     holdings: dict[str, int]
-    transactions: list[Transaction]
-    portfolio_value_time_series: list[tuple[str, float]]
+    net_invested: float = 0.0
+    realized_pnl: float = 0.0
+    cost_basis: dict[str, float] = {}
+    version: int = 0
+    # The history is loaded from the database the first time it is used; None until then
+    _transactions: TransactionLedger | None = PrivateAttr(default=None)
+    _portfolio_value_time_series: list[tuple[str, float]] | None = PrivateAttr(default=None)
+
+    def __init__(self, transactions=None, portfolio_value_time_series=None, **fields):
+        super().__init__(**fields)
+        if transactions is not None:
+            self._transactions = TransactionLedger.from_records(transactions)
+        if portfolio_value_time_series is not None:
+            self._portfolio_value_time_series = [tuple(point) for point in portfolio_value_time_series]
+
+    @property
+    def transactions(self) -> TransactionLedger:
+        if self._transactions is None:
+            self._transactions = TransactionLedger.from_records(read_transactions(self.name))
+        return self._transactions
+
+    @transactions.setter
+    def transactions(self, transactions):
+        self._transactions = TransactionLedger.from_records(transactions)
+
+    @property
+    def portfolio_value_time_series(self) -> list[tuple[str, float]]:
+        if self._portfolio_value_time_series is None:
+            self._portfolio_value_time_series = read_portfolio_values(self.name)
+        return self._portfolio_value_time_series
+
+    @portfolio_value_time_series.setter
+    def portfolio_value_time_series(self, points):
+        self._portfolio_value_time_series = list(points)
+
+    @staticmethod
+    def new_account_fields(name: str) -> dict:
+        return {
+            "name": name.lower(),
+            "balance": INITIAL_BALANCE,
+            "strategy": "",
+            "holdings": {},
+            "transactions": [],
+            "portfolio_value_time_series": [],
+            "net_invested": 0.0,
+            "realized_pnl": 0.0,
+            "cost_basis": {}
+        }
 
     @classmethod
     def get(cls, name: str):
-        fields = read_account(name.lower())
+        """ Return the cached account if it is still current, otherwise load its summary (creating it if new). """
+        name = name.lower()
+        cached = _identity_map.get(name)
+        if cached is not None and cached.version == read_account_version(name):
+            return cached
+        fields = read_account_summary(name)
         if not fields:
-            fields = {
-                "name": name.lower(),
-                "balance": INITIAL_BALANCE,
-                "strategy": "",
-                "holdings": {},
-                "transactions": [],
-                "portfolio_value_time_series": []
-            }
-            write_account(name, fields)
-        return cls(**fields)
-    
-    
+            try:
+                write_account(name, cls.new_account_fields(name), expected_version=0)
+            except VersionConflict:
+                pass  # Another session created it first; use theirs
+            fields = read_account_summary(name)
+        account = _identity_map[name] = cls(**fields)
+        return account
+
+    @classmethod
+    async def aget(cls, name: str):
+        """ Like get, without blocking the event loop. """
+        name = name.lower()
+        cached = _identity_map.get(name)
+        if cached is not None and cached.version == await async_database.read_account_version(name):
+            return cached
+        fields = await async_database.read_account_summary(name)
+        if not fields:
+            try:
+                await async_database.write_account(name, cls.new_account_fields(name), expected_version=0)
+            except VersionConflict:
+                pass  # Another session created it first; use theirs
+            fields = await async_database.read_account_summary(name)
+        account = _identity_map[name] = cls(**fields)
+        return account
+
+    def dump(self) -> dict:
+        """ The account's fields plus its full history, loading the history if needed. """
+        data = self.model_dump()
+        data["transactions"] = self.transactions.to_list()
+        data["portfolio_value_time_series"] = self.portfolio_value_time_series
+        return data
+
+    def refresh(self):
+        """ Reload this account's summary in place from the database, discarding any unsaved changes. """
+        for field, value in type(self)(**read_account_summary(self.name)):
+            setattr(self, field, value)
+        self._transactions = self._portfolio_value_time_series = None
+        _identity_map[self.name.lower()] = self
+
+    def _discard_changes(self):
+        """ Throw away unsaved changes after a failed write. """
+        # If the reload fails too, no write from this copy can pass the version check until it is reloaded
+        self.version = -1
+        try:
+            self.refresh()
+        except Exception as e:
+            _identity_map.pop(self.name.lower(), None)
+            print(f"Was not able to reload account {self.name} due to {e}", file=sys.stderr)
+
+    # Every save is a compare-and-swap against the version this account was read at,
+    # raising VersionConflict if another writer has changed it since.
+
     def save(self):
-        write_account(self.name.lower(), self.model_dump())
+        self.version = write_account(self.name.lower(), self.dump(), self.version)
+
+    def save_summary(self):
+        """ Persist only the balance and strategy, leaving the account's history untouched. """
+        self.version = write_account_summary(self.name, self.balance, self.strategy, self.version)
+
+    def save_trade(self, transaction: Transaction):
+        """ Persist one trade: the new balance and running totals, the affected holding and the transaction row. """
+        symbol = transaction.symbol
+        self.version = write_trade(self.name, self.balance, self.net_invested, self.realized_pnl, symbol,
+                                   self.holdings.get(symbol, 0), self.cost_basis.get(symbol, 0.0),
+                                   transaction.model_dump(), self.version)
 
+    @_exclusive
     def reset(self, strategy: str):
         self.balance = INITIAL_BALANCE
         self.strategy = strategy
         self.holdings = {}
-        self.transactions = []
+        self.transactions = TransactionLedger()
         self.portfolio_value_time_series = []
+        self.net_invested = 0.0
+        self.realized_pnl = 0.0
+        self.cost_basis = {}
         self.save()
 
+    @_exclusive
     def deposit(self, amount: float):
         """ Deposit funds into the account. """
         if amount <= 0:
             raise ValueError("Deposit amount must be positive.")
         self.balance += amount
         print(f"Deposited ${amount}. New balance: ${self.balance}")
-        self.save()
+        self.save_summary()
 
+    @_exclusive
     def withdraw(self, amount: float):
         """ Withdraw funds from the account, ensuring it doesn't go negative. """
         if amount > self.balance:
             raise ValueError("Insufficient funds for withdrawal.")
         self.balance -= amount
         print(f"Withdrew ${amount}. New balance: ${self.balance}")
-        self.save()
+        self.save_summary()
 
-    def buy_shares(self, symbol: str, quantity: int, rationale: str) -> str:
+    @_exclusive
+    def buy_shares(self, symbol: str, quantity: int, rationale: str, report_mode: str = COMPACT_REPORT) -> str:
         """ Buy shares of a stock if sufficient funds are available. """
-        price = get_share_price(symbol)
+        prices = self.price_snapshot(symbol)
+        transaction = self._buy(symbol, quantity, rationale, prices)
+        portfolio_value = self.calculate_portfolio_value(prices)
+        with unit_of_work():
+            self.save_trade(transaction)
+            self.record_portfolio_value(portfolio_value)
+        write_log(self.name, "account", f"Bought {quantity} of {symbol}")
+        return "Completed. Latest details:\n" + self._report_json(portfolio_value, report_mode)
+
+    @_exclusive
+    def sell_shares(self, symbol: str, quantity: int, rationale: str, report_mode: str = COMPACT_REPORT) -> str:
+        """ Sell shares of a stock if the user has enough shares. """
+        if self.holdings.get(symbol, 0) < quantity:
+            raise ValueError(f"Cannot sell {quantity} shares of {symbol}. Not enough shares held.")
+        prices = self.price_snapshot(symbol)
+        transaction = self._sell(symbol, quantity, rationale, prices)
+        portfolio_value = self.calculate_portfolio_value(prices)
+        with unit_of_work():
+            self.save_trade(transaction)
+            self.record_portfolio_value(portfolio_value)
+        write_log(self.name, "account", f"Sold {quantity} of {symbol}")
+        return "Completed. Latest details:\n" + self._report_json(portfolio_value, report_mode)
+
+    @_exclusive
+    def execute_orders(self, orders: list[Order], report_mode: str = COMPACT_REPORT) -> str:
+        """ Execute a basket of orders against one price snapshot, all or nothing. Sells go first so their proceeds can fund the buys. """
+        if not orders:
+            raise ValueError("No orders to execute.")
+        orders = sorted((Order.model_validate(order) for order in orders), key=lambda order: order.action != "sell")
+        prices = self.price_snapshot(*(order.symbol for order in orders))
+        try:
+            transactions = [
+                (self._sell if order.action == "sell" else self._buy)(order.symbol, order.quantity, order.rationale, prices)
+                for order in orders
+            ]
+        except ValueError as e:
+            # Nothing has been written yet, and _exclusive undoes the orders already applied in memory
+            raise ValueError(f"No orders executed: {e}") from e
+        portfolio_value = self.calculate_portfolio_value(prices)
+        with unit_of_work():
+            for transaction in transactions:
+                self.save_trade(transaction)
+            self.record_portfolio_value(portfolio_value)
+        write_log(self.name, "account", "Executed " + ", ".join(
+            f"{'sell' if t.quantity < 0 else 'buy'} {abs(t.quantity)} of {t.symbol}" for t in transactions))
+        return f"Completed {len(transactions)} orders. Latest details:\n" + self._report_json(portfolio_value, report_mode)
+
+    def _buy(self, symbol: str, quantity: int, rationale: str, prices: dict[str, float]) -> Transaction:
+        """ Apply a purchase to the account in memory and return its transaction. """
+        price = prices[symbol]
         buy_price = price * (1 + SPREAD)
         total_cost = buy_price * quantity
         
@@ -89,74 +312,141 @@ class Account(BaseModel):
         
         # Update holdings
         self.holdings[symbol] = self.holdings.get(symbol, 0) + quantity
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.cost_basis[symbol] = self.cost_basis.get(symbol, 0.0) + total_cost
+        self.net_invested += total_cost
         # Record transaction
-        transaction = Transaction(symbol=symbol, quantity=quantity, price=buy_price, timestamp=timestamp, rationale=rationale)
-        self.transactions.append(transaction)
+        transaction = self._record(symbol, quantity, buy_price, rationale)
         
         # Update balance
         self.balance -= total_cost
-        self.save()
-        write_log(self.name, "account", f"Bought {quantity} of {symbol}")
-        return "Completed. Latest details:\n" + self.report()
+        return transaction
 
-    def sell_shares(self, symbol: str, quantity: int, rationale: str) -> str:
-        """ Sell shares of a stock if the user has enough shares. """
+    def _sell(self, symbol: str, quantity: int, rationale: str, prices: dict[str, float]) -> Transaction:
+        """ Apply a sale to the account in memory and return its transaction. """
         if self.holdings.get(symbol, 0) < quantity:
             raise ValueError(f"Cannot sell {quantity} shares of {symbol}. Not enough shares held.")
         
-        price = get_share_price(symbol)
+        price = prices[symbol]
+        if price == 0:
+            raise ValueError(f"No price available for {symbol}; not selling it for nothing")
         sell_price = price * (1 - SPREAD)
         total_proceeds = sell_price * quantity
         
+        # Realize the profit against the average cost of the shares sold
+        cost_sold = self.cost_basis.get(symbol, 0.0) * quantity / self.holdings[symbol]
+        self.cost_basis[symbol] = self.cost_basis.get(symbol, 0.0) - cost_sold
+        self.realized_pnl += total_proceeds - cost_sold
+        self.net_invested -= total_proceeds
+
         # Update holdings
         self.holdings[symbol] -= quantity
         
         # If shares are completely sold, remove from holdings
         if self.holdings[symbol] == 0:
             del self.holdings[symbol]
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self.cost_basis.pop(symbol, None)
         # Record transaction
-        transaction = Transaction(symbol=symbol, quantity=-quantity, price=sell_price, timestamp=timestamp, rationale=rationale)  # negative quantity for sell
-        self.transactions.append(transaction)
+        transaction = self._record(symbol, -quantity, sell_price, rationale)  # negative quantity for sell
 
         # Update balance
         self.balance += total_proceeds
-        self.save()
-        write_log(self.name, "account", f"Sold {quantity} of {symbol}")
-        return "Completed. Latest details:\n" + self.report()
+        return transaction
+
+    def _record(self, symbol: str, quantity: int, price: float, rationale: str) -> Transaction:
+        """ Make the transaction for a trade, adding it to the ledger only if the history has been loaded. """
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if self._transactions is not None:
+            self._transactions.append(symbol, quantity, price, timestamp, rationale)
+        return Transaction(symbol=symbol, quantity=quantity, price=price, timestamp=timestamp, rationale=rationale)
 
-    def calculate_portfolio_value(self):
-        """ Calculate the total value of the user's portfolio. """
-        total_value = self.balance
-        for symbol, quantity in self.holdings.items():
-            total_value += get_share_price(symbol) * quantity
-        return total_value
+    def price_snapshot(self, *symbols: str) -> dict[str, float]:
+        """ Price the given symbols and every holding in one lookup, so a trade works from one consistent set of prices. """
+        return get_share_prices([*symbols, *self.holdings], PRIORITY_TRADE)
+
+    def calculate_portfolio_value(self, prices: dict[str, float] | None = None):
+        """ Calculate the total value of the user's portfolio, using prices when they are given. """
+        if prices is None:
+            prices = get_share_prices(self.holdings)
+        return self.balance + sum(prices[symbol] * quantity for symbol, quantity in self.holdings.items())
 
     def calculate_profit_loss(self, portfolio_value: float):
-        """ Calculate profit or loss from the initial spend. """
-        initial_spend = sum(transaction.total() for transaction in self.transactions)
-        return portfolio_value - initial_spend - self.balance
+        """ Calculate profit or loss from the net amount invested, kept up to date on every trade. """
+        return portfolio_value - self.net_invested - self.balance
+
+    # Readers take the account's lock too, so they never see a change that is still being
+    # written, and return copies rather than the shared account's own containers
+
+    def get_balance(self) -> float:
+        """ Report the user's cash balance. """
+        with _account_lock(self.name):
+            return self.balance
 
     def get_holdings(self):
         """ Report the current holdings of the user. """
-        return self.holdings
+        with _account_lock(self.name):
+            return dict(self.holdings)
 
     def get_profit_loss(self):
         """ Report the user's profit or loss at any point in time. """
-        return self.calculate_profit_loss()
+        with _account_lock(self.name):
+            return self.calculate_profit_loss(self.calculate_portfolio_value())
 
     def list_transactions(self):
         """ List all transactions made by the user. """
-        return [transaction.model_dump() for transaction in self.transactions]
+        return self.transactions.to_list()
     
-    def report(self) -> str:
-        """ Return a json string representing the account.  """
-        portfolio_value = self.calculate_portfolio_value()
-        self.portfolio_value_time_series.append((datetime.now().strftime("%Y-%m-%d %H:%M:%S"), portfolio_value))
-        self.save()
+    def recent_transactions(self, n: int = RECENT_TRANSACTIONS) -> list[dict]:
+        """ The last n transactions, oldest first, read from the database unless the history is already loaded. """
+        if n <= 0:
+            return []
+        if self._transactions is not None:
+            ledger = self._transactions
+            return [ledger[i].model_dump() for i in range(max(0, len(ledger) - n), len(ledger))]
+        rows, _ = read_transactions_page(self.name, None, n)
+        return [dict(zip(TRANSACTION_FIELDS, row)) for row in reversed(rows)]
+
+    def transactions_page(self, cursor: int | None = None, limit: int = REPORT_PAGE_SIZE) -> tuple[list[dict], int | None]:
+        """ One page of transactions, newest first, and the cursor for the next older page (None when there are no more). """
+        if limit <= 0:
+            return [], None
+        rows, cursor = read_transactions_page(self.name, cursor, limit)
+        return [dict(zip(TRANSACTION_FIELDS, row)) for row in rows], cursor
+
+    def report(self, mode: str = "full", last_n: int = RECENT_TRANSACTIONS, cursor: int | None = None,
+               limit: int = REPORT_PAGE_SIZE) -> str:
+        """
+        Return a json string representing the account. Reports only read, so viewing an
+        account neither adds to its portfolio value history nor changes its version.
+
+        Args:
+            mode: One of REPORT_MODES; "full" includes the whole history
+            last_n: How many transactions the "recent" mode includes
+            cursor: Where the "page" mode starts, from the previous page's next_cursor; None for the newest
+            limit: How many transactions the "page" mode includes
+        """
+        if mode not in REPORT_MODES:
+            raise ValueError(f"Unknown report mode {mode}; expected one of {', '.join(REPORT_MODES)}")
+        with _account_lock(self.name):
+            return self._report_json(self.calculate_portfolio_value(), mode, last_n, cursor, limit)
+
+    def record_portfolio_value(self, portfolio_value: float):
+        """ Append the current portfolio value to the account's history. """
+        point = (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), portfolio_value)
+        if self._portfolio_value_time_series is not None:
+            self._portfolio_value_time_series.append(point)
+        self.version = write_portfolio_value(self.name, *point, self.version)
+
+    def _report_json(self, portfolio_value: float, mode: str = "full", last_n: int = RECENT_TRANSACTIONS,
+                     cursor: int | None = None, limit: int = REPORT_PAGE_SIZE) -> str:
         pnl = self.calculate_profit_loss(portfolio_value)
-        data = self.model_dump()
+        if mode == "full":
+            data = self.dump()
+        else:
+            data = self.model_dump()
+            if mode == "recent":
+                data["recent_transactions"] = self.recent_transactions(last_n)
+            elif mode == "page":
+                data["transactions"], data["next_cursor"] = self.transactions_page(cursor, limit)
         data["total_portfolio_value"] = portfolio_value
         data["total_profit_loss"] = pnl
         write_log(self.name, "account", f"Retrieved account details")
@@ -165,12 +455,14 @@ class Account(BaseModel):
     def get_strategy(self) -> str:
         """ Return the strategy of the account """
         write_log(self.name, "account", f"Retrieved strategy")
-        return self.strategy
+        with _account_lock(self.name):
+            return self.strategy
     
+    @_exclusive
     def change_strategy(self, strategy: str) -> str:
         """ At your discretion, if you choose to, call this to change your investment strategy for the future """
         self.strategy = strategy
-        self.save()
+        self.save_summary()
         write_log(self.name, "account", f"Changed strategy")
         return "Changed strategy"
 
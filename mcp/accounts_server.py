@@ -1,12 +1,16 @@
 import sys
 import os
+import asyncio
 # Ensure the script's directory is in the Python path for imports
 _script_dir = os.path.dirname(os.path.abspath(__file__))
 if _script_dir not in sys.path:
     sys.path.insert(0, _script_dir)
 
 from mcp.server.fastmcp import FastMCP
-from accounts import Account
+from accounts import Account, Order, COMPACT_REPORT
+from market import start_price_feed
+import analytics
+import async_database
 
 mcp = FastMCP("accounts_server")
 
@@ -17,7 +21,8 @@ async def get_balance(name: str) -> float:
     Args:
         name: The name of the account holder
     """
-    return Account.get(name).balance
+    account = await Account.aget(name)
+    return await asyncio.to_thread(account.get_balance)
 
 @mcp.tool()
 async def get_holdings(name: str) -> dict[str, int]:
@@ -26,7 +31,8 @@ async def get_holdings(name: str) -> dict[str, int]:
     Args:
         name: The name of the account holder
     """
-    return Account.get(name).holdings
+    account = await Account.aget(name)
+    return await asyncio.to_thread(account.get_holdings)
 
 @mcp.tool()
 async def buy_shares(name: str, symbol: str, quantity: int, rationale: str) -> float:
@@ -38,7 +44,8 @@ async def buy_shares(name: str, symbol: str, quantity: int, rationale: str) -> f
         quantity: The quantity of shares to buy
         rationale: The rationale for the purchase and fit with the account's strategy
     """
-    return Account.get(name).buy_shares(symbol, quantity, rationale)
+    account = await Account.aget(name)
+    return await asyncio.to_thread(account.buy_shares, symbol, quantity, rationale)
 
 
 @mcp.tool()
@@ -51,7 +58,22 @@ async def sell_shares(name: str, symbol: str, quantity: int, rationale: str) ->
         quantity: The quantity of shares to sell
         rationale: The rationale for the sale and fit with the account's strategy
     """
-    return Account.get(name).sell_shares(symbol, quantity, rationale)
+    account = await Account.aget(name)
+    return await asyncio.to_thread(account.sell_shares, symbol, quantity, rationale)
+
+@mcp.tool()
+async def execute_orders(name: str, orders: list[Order]) -> str:
+    """Execute several buy and sell orders together, e.g. to rebalance, in one call.
+
+    All orders are priced from the same snapshot and either all complete or none do.
+    Sells are applied before buys, so their proceeds can fund the purchases.
+
+    Args:
+        name: The name of the account holder
+        orders: The orders, each with an action ("buy" or "sell"), symbol, quantity and rationale
+    """
+    account = await Account.aget(name)
+    return await asyncio.to_thread(account.execute_orders, orders)
 
 @mcp.tool()
 async def change_strategy(name: str, strategy: str) -> str:
@@ -61,17 +83,64 @@ async def change_strategy(name: str, strategy: str) -> str:
         name: The name of the account holder
         strategy: The new strategy for the account
     """
-    return Account.get(name).change_strategy(strategy)
+    account = await Account.aget(name)
+    return await asyncio.to_thread(account.change_strategy, strategy)
+
+@mcp.tool()
+async def get_account_report(name: str, mode: str = "summary", last_n: int = 5, cursor: int | None = None, limit: int = 50) -> str:
+    """Get a report on the account, with as much of its history as needed.
+
+    Args:
+        name: The name of the account holder
+        mode: "summary" for balance, holdings and P&L only; "recent" to add the last_n transactions;
+            "page" to add limit transactions starting at cursor, newest first; "full" for the whole history
+        last_n: How many transactions "recent" includes
+        cursor: For "page", the next_cursor from the previous page, or omit for the newest transactions
+        limit: How many transactions "page" includes
+    """
+    account = await Account.aget(name)
+    return await asyncio.to_thread(account.report, mode, last_n, cursor, limit)
+
+@mcp.tool()
+async def get_portfolio_analytics(name: str, benchmark: str = analytics.DEFAULT_BENCHMARK, window: int = analytics.DEFAULT_WINDOW,
+                                  resolution: str | None = None) -> dict:
+    """Get risk metrics for the account's portfolio value history: total return, volatility,
+    rolling volatility, max drawdown, Sharpe and Sortino ratios, and beta against a benchmark.
+
+    Args:
+        name: The name of the account holder
+        benchmark: The symbol to measure beta against
+        window: The number of portfolio value points in the rolling volatility window
+        resolution: "raw", "minute", "hour" or "day"; omit to use the finest one that keeps the series short
+    """
+    return await asyncio.to_thread(analytics.portfolio_analytics, name, benchmark, window, resolution)
+
+@mcp.tool()
+async def get_portfolio_value_history(name: str, start: str | None = None, end: str | None = None,
+                                      resolution: str | None = None) -> dict:
+    """Get the account's portfolio value over time as open, high, low and close per period, for charting.
+
+    Args:
+        name: The name of the account holder
+        start: The first time to include, as "YYYY-MM-DD HH:MM:SS"; omit for the whole history
+        end: The last time to include; omit for up to now
+        resolution: "raw", "minute", "hour" or "day"; omit to pick one that gives at most a few thousand points
+    """
+    resolution, rows = await async_database.read_portfolio_value_range(name, start, end, resolution)
+    return {"resolution": resolution,
+            "points": [{"datetime": datetime, "open": open, "high": high, "low": low, "close": close}
+                       for datetime, open, high, low, close in rows]}
 
 @mcp.resource("accounts://accounts_server/{name}")
 async def read_account_resource(name: str) -> str:
-    account = Account.get(name.lower())
-    return account.report()
+    account = await Account.aget(name.lower())
+    return await asyncio.to_thread(account.report, COMPACT_REPORT)
 
 @mcp.resource("accounts://strategy/{name}")
 async def read_strategy_resource(name: str) -> str:
-    account = Account.get(name.lower())
-    return account.get_strategy()
+    account = await Account.aget(name.lower())
+    return await asyncio.to_thread(account.get_strategy)
 
 if __name__ == "__main__":
+    start_price_feed()
     mcp.run(transport='stdio')
\ No newline at end of file
@@ -0,0 +1,201 @@
+"""
+Risk and return metrics over an account's portfolio value history.
+
+The history is read from the downsampled store at the finest resolution that
+keeps the series to a bounded number of points (database.choose_portfolio_resolution),
+using each bucket's close. Series are held in memory as NumPy arrays and topped up
+with only the points at or after the last one loaded, so repeated queries cost one
+indexed read. Every metric is vectorized, and results are cached until the series changes.
+"""
+import os
+import threading
+import numpy as np
+from database import choose_portfolio_resolution, read_portfolio_value_range, read_portfolio_value_start
+import sys
+from market import history, backfill_history, polygon_api_key
+
+SECONDS_PER_YEAR = 365.25 * 24 * 3600
+RISK_FREE_RATE = float(os.getenv("RISK_FREE_RATE", "0"))
+DEFAULT_BENCHMARK = os.getenv("ANALYTICS_BENCHMARK", "SPY")
+DEFAULT_WINDOW = 20
+
+
+class _Series:
+    """One account's (timestamp, close) points at one resolution, plus where its stored history starts."""
+
+    def __init__(self):
+        self.start = None
+        self.timestamps = np.empty(0, dtype="datetime64[s]")
+        self.values = np.empty(0, dtype=np.float64)
+
+
+_series: dict[tuple[str, str], _Series] = {}
+# (symbol, first day, last day) ranges already fetched from Polygon by this process
+_backfilled: set[tuple] = set()
+_metrics_cache: dict[tuple, tuple[tuple, dict]] = {}
+_lock = threading.Lock()
+
+
+def load_series(name: str, resolution: str | None = None) -> tuple[str, np.ndarray, np.ndarray]:
+    """
+    Return an account's portfolio value history as (resolution, timestamps, values), oldest first.
+
+    Only points at or after the last one loaded are read, since the latest bucket may still be
+    filling; if the history now starts somewhere else (after a reset or pruning) it is read again.
+    """
+    name = name.lower()
+    resolution = resolution or choose_portfolio_resolution(name)
+    with _lock:
+        series = _series.setdefault((name, resolution), _Series())
+        start = read_portfolio_value_start(name, resolution)
+        if start != series.start:
+            series = _series[(name, resolution)] = _Series()
+            series.start = start
+        keep = len(series.values)
+        after = None
+        if keep:
+            after = series.timestamps[-1]
+            keep = int(np.searchsorted(series.timestamps, after, side="left"))
+            after = str(after).replace("T", " ")
+        _, rows = read_portfolio_value_range(name, after, resolution=resolution)
+        if rows:
+            timestamps, _, _, _, closes = zip(*rows)
+            series.timestamps = np.concatenate([series.timestamps[:keep], np.array(timestamps, dtype="datetime64[s]")])
+            series.values = np.concatenate([series.values[:keep], np.array(closes, dtype=np.float64)])
+        return resolution, series.timestamps, series.values
+
+
+def returns(values: np.ndarray) -> np.ndarray:
+    """Simple returns between consecutive points."""
+    return values[1:] / values[:-1] - 1
+
+
+def periods_per_year(timestamps: np.ndarray) -> float:
+    """How many points the series has per year, from its observed spacing; gaps such as nights and weekends are included."""
+    if len(timestamps) < 2:
+        return float("nan")
+    span = (timestamps[-1] - timestamps[0]) / np.timedelta64(1, "s")
+    return (len(timestamps) - 1) * SECONDS_PER_YEAR / span if span > 0 else float("nan")
+
+
+def rolling_volatility(period_returns: np.ndarray, window: int) -> np.ndarray:
+    """Sample standard deviation of each run of window returns, from running sums so it costs O(n) for any window."""
+    if len(period_returns) < window or window < 2:
+        return np.empty(0)
+    sums = np.concatenate([[0.0], np.cumsum(period_returns)])
+    squares = np.concatenate([[0.0], np.cumsum(period_returns ** 2)])
+    total = sums[window:] - sums[:-window]
+    total_squares = squares[window:] - squares[:-window]
+    variance = (total_squares - total ** 2 / window) / (window - 1)
+    return np.sqrt(np.maximum(variance, 0.0))
+
+
+def max_drawdown(values: np.ndarray) -> float:
+    """The largest fall from a running peak, as a negative fraction of that peak."""
+    if len(values) == 0:
+        return float("nan")
+    return float(np.min(values / np.maximum.accumulate(values) - 1))
+
+
+def sharpe_ratio(period_returns: np.ndarray, per_year: float, risk_free_rate: float = RISK_FREE_RATE) -> float:
+    """Annualized mean excess return over its standard deviation."""
+    if len(period_returns) < 2:
+        return float("nan")
+    excess = period_returns - risk_free_rate / per_year
+    deviation = excess.std(ddof=1)
+    return float(excess.mean() / deviation * np.sqrt(per_year)) if deviation > 0 else float("nan")
+
+
+def sortino_ratio(period_returns: np.ndarray, per_year: float, risk_free_rate: float = RISK_FREE_RATE) -> float:
+    """Like the Sharpe ratio, but only returns below the risk-free rate count as risk."""
+    if len(period_returns) < 2:
+        return float("nan")
+    excess = period_returns - risk_free_rate / per_year
+    downside = np.sqrt(np.mean(np.minimum(excess, 0.0) ** 2))
+    return float(excess.mean() / downside * np.sqrt(per_year)) if downside > 0 else float("nan")
+
+
+def daily_closes(timestamps: np.ndarray, values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """The last value on each calendar day."""
+    days = timestamps.astype("datetime64[D]")
+    last = np.flatnonzero(np.append(days[1:] != days[:-1], True)) if len(days) else np.empty(0, dtype=int)
+    return days[last], values[last]
+
+
+def _ensure_benchmark_history(benchmark: str, start: np.datetime64, end: np.datetime64) -> None:
+    """Backfill the benchmark's daily bars from Polygon when the history store does not cover start to end."""
+    bars = history.bars(benchmark, start, end)
+    # The last day may not have closed yet, so only a missing bar at the start or a gap of days at the end counts
+    covered = len(bars["date"]) and bars["date"][0] <= start + np.timedelta64(3, "D") and bars["date"][-1] >= end - np.timedelta64(3, "D")
+    key = (benchmark, str(start), str(end))
+    if covered or not polygon_api_key or key in _backfilled:
+        return
+    _backfilled.add(key)
+    try:
+        backfill_history([benchmark], str(start), str(end))
+    except Exception as e:
+        print(f"Was not able to backfill {benchmark} history due to {e}", file=sys.stderr)
+
+
+def beta(timestamps: np.ndarray, values: np.ndarray, benchmark: str) -> float:
+    """
+    Beta of the portfolio's daily returns against a benchmark symbol's, over the days both have.
+
+    Benchmark closes come from the local history store. Days it is missing are fetched once per
+    range with market.backfill_history, at valuation priority under the Polygon rate limit; the
+    result is NaN until the store covers at least three overlapping days.
+    """
+    days, closes = daily_closes(timestamps, values)
+    if len(days) < 3:
+        return float("nan")
+    _ensure_benchmark_history(benchmark, days[0], days[-1])
+    bench = history.bars(benchmark, days[0], days[-1])
+    common, ours, theirs = np.intersect1d(days, bench["date"], return_indices=True)
+    if len(common) < 3:
+        return float("nan")
+    portfolio_returns = returns(closes[ours])
+    benchmark_returns = returns(bench["close"][theirs])
+    variance = benchmark_returns.var(ddof=1)
+    return float(np.cov(portfolio_returns, benchmark_returns, ddof=1)[0, 1] / variance) if variance > 0 else float("nan")
+
+
+def portfolio_analytics(name: str, benchmark: str = DEFAULT_BENCHMARK, window: int = DEFAULT_WINDOW,
+                        resolution: str | None = None) -> dict:
+    """
+    Risk metrics for an account's portfolio value history, recomputed only when the series has changed.
+
+    Args:
+        name: The account name
+        benchmark: Symbol to measure beta against
+        window: Number of points in the rolling volatility window
+        resolution: "raw", "minute", "hour" or "day", or None to pick one that bounds the number of points
+
+    Returns:
+        dict: The metrics, with volatility annualized; a metric is None when there is not enough history for it
+    """
+    resolution, timestamps, values = load_series(name, resolution)
+    key = (name.lower(), resolution, benchmark, window)
+    state = (len(values), timestamps[0], values[-1]) if len(values) else (0,)
+    cached = _metrics_cache.get(key)
+    if cached is not None and cached[0] == state:
+        return cached[1]
+    period_returns = returns(values)
+    per_year = periods_per_year(timestamps)
+    rolling = rolling_volatility(period_returns, window)
+    metrics = {
+        "resolution": resolution,
+        "points": len(values),
+        "start": str(timestamps[0]) if len(values) else None,
+        "end": str(timestamps[-1]) if len(values) else None,
+        "total_return": float(values[-1] / values[0] - 1) if len(values) else float("nan"),
+        "volatility": float(period_returns.std(ddof=1) * np.sqrt(per_year)) if len(period_returns) > 1 else float("nan"),
+        "rolling_volatility": float(rolling[-1] * np.sqrt(per_year)) if len(rolling) else float("nan"),
+        "max_drawdown": max_drawdown(values),
+        "sharpe_ratio": sharpe_ratio(period_returns, per_year),
+        "sortino_ratio": sortino_ratio(period_returns, per_year),
+        "benchmark": benchmark,
+        "beta": beta(timestamps, values, benchmark),
+    }
+    metrics = {field: None if isinstance(value, float) and not np.isfinite(value) else value for field, value in metrics.items()}
+    _metrics_cache[key] = (state, metrics)
+    return metrics
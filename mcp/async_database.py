@@ -0,0 +1,42 @@
+"""
+Async access to the account database for the FastMCP servers.
+
+Like aiosqlite, every call runs the blocking sqlite work on a worker thread and
+awaits the result, so the event loop keeps serving other sessions meanwhile.
+Calls run concurrently on a small pool of threads, each with its own WAL
+connection from database.get_connection().
+
+Only account loading and creation and the history range reads go through here.
+Account changes (trades, deposits, strategy updates) also do price lookups, so
+the servers run those Account methods with asyncio.to_thread; their writes are
+ordered by the account version check rather than by a dedicated writer thread.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import database
+
+DATABASE_THREADS = 4
+
+_pool = ThreadPoolExecutor(max_workers=DATABASE_THREADS, thread_name_prefix="db")
+
+
+async def run_blocking(fn, *args):
+    """Run a blocking database call on the pool."""
+    return await asyncio.get_running_loop().run_in_executor(_pool, fn, *args)
+
+
+async def read_account_summary(name: str) -> dict | None:
+    return await run_blocking(database.read_account_summary, name)
+
+
+async def read_account_version(name: str) -> int | None:
+    return await run_blocking(database.read_account_version, name)
+
+
+async def write_account(name: str, account_dict: dict, expected_version: int | None = None) -> int:
+    return await run_blocking(database.write_account, name, account_dict, expected_version)
+
+
+async def read_portfolio_value_range(name: str, start: str | None = None, end: str | None = None,
+                                     resolution: str | None = None) -> tuple[str, list]:
+    return await run_blocking(database.read_portfolio_value_range, name, start, end, resolution)
@@ -0,0 +1,160 @@
+"""
+Benchmark the accounts workload against a scratch database.
+
+Prices come from the seeded market simulator, so runs are reproducible and
+the numbers measure our own storage and bookkeeping rather than the Polygon API.
+
+Usage:
+    uv run benchmark.py --trades 1000
+    uv run benchmark.py --stress 8 --trades 200   # 8 processes trading one account, then reconcile
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Ensure the script's directory is in the Python path for imports
+_script_dir = os.path.dirname(os.path.abspath(__file__))
+if _script_dir not in sys.path:
+    sys.path.insert(0, _script_dir)
+
+
+def use_scratch_database() -> str:
+    """Point database.py at a fresh file so the real accounts.db is never touched."""
+    path = os.path.join(tempfile.mkdtemp(prefix="accounts-bench-"), "accounts.db")
+    os.environ["ACCOUNTS_DB"] = path
+    return path
+
+
+def bench_trades(trades: int) -> list[float]:
+    """Alternate buys and sells on one account and return each trade's latency in seconds."""
+    import market
+    from accounts import Account
+
+    market.set_price_backend(market.simulator)
+    account = Account.get("benchmark")
+    account.deposit(1_000_000)
+
+    latencies = []
+    for i in range(trades):
+        start = time.perf_counter()
+        if i % 2 == 0:
+            account.buy_shares("AAPL", 1, "benchmark")
+        else:
+            account.sell_shares("AAPL", 1, "benchmark")
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+STRESS_ACCOUNT = "stress"
+STRESS_SYMBOLS = ("AAPL", "MSFT", "NVDA")
+
+
+def _stress_worker(seed: int, trades: int, deposit: float, start) -> tuple[int, int, float]:
+    """
+    Random buys and sells against the shared account from its own process.
+
+    Every worker waits on the start barrier and then looks the account up before it
+    exists, so they race to create it, and then deposits its share of the funds.
+
+    Returns:
+        tuple: (trades completed, trades given up on conflicts, amount deposited)
+    """
+    import market
+    from accounts import Account
+    from database import VersionConflict
+
+    market.set_price_backend(market.simulator)
+    rng = random.Random(seed)
+    completed = gave_up = 0
+    start.wait()
+    try:
+        Account.get(STRESS_ACCOUNT).deposit(deposit)
+    except VersionConflict:
+        deposit = 0.0
+    for _ in range(trades):
+        account = Account.get(STRESS_ACCOUNT)
+        symbol = rng.choice(STRESS_SYMBOLS)
+        try:
+            if rng.random() < 0.6:
+                account.buy_shares(symbol, rng.randint(1, 5), "stress")
+            else:
+                account.sell_shares(symbol, rng.randint(1, 5), "stress")
+            completed += 1
+        except VersionConflict:
+            gave_up += 1
+        except ValueError:
+            pass  # Not enough shares to sell, which is expected with random orders
+    return completed, gave_up, deposit
+
+
+def stress(processes: int, trades: int) -> list[str]:
+    """
+    Trade one account from several processes at once, then check that nothing was lost.
+
+    Returns:
+        list: A description of each mismatch between the stored account and its transactions; empty if they reconcile
+    """
+    from accounts import INITIAL_BALANCE
+    from database import read_account, _replay_accounting
+
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager, context.Pool(processes) as pool:
+        start = manager.Barrier(processes)
+        results = pool.starmap(_stress_worker, [(seed, trades, 1_000_000 / processes, start) for seed in range(processes)])
+    completed = sum(done for done, _, _ in results)
+    gave_up = sum(conflicts for _, conflicts, _ in results)
+    deposit = sum(deposited for _, _, deposited in results)
+
+    stored = read_account(STRESS_ACCOUNT)
+    transactions = stored["transactions"]
+    problems = []
+    if len(transactions) != completed:
+        problems.append(f"{completed} trades completed but {len(transactions)} recorded")
+    balance = INITIAL_BALANCE + deposit - sum(quantity * price for _, quantity, price, _, _ in transactions)
+    if abs(stored["balance"] - balance) > 1e-6:
+        problems.append(f"balance {stored['balance']} but transactions imply {balance}")
+    holdings = {}
+    for symbol, quantity, _, _, _ in transactions:
+        holdings[symbol] = holdings.get(symbol, 0) + quantity
+    if stored["holdings"] != {symbol: quantity for symbol, quantity in holdings.items() if quantity}:
+        problems.append(f"holdings {stored['holdings']} but transactions imply {holdings}")
+    net_invested, realized_pnl, _ = _replay_accounting(t[:3] for t in transactions)
+    if abs(stored["net_invested"] - net_invested) > 1e-6 or abs(stored["realized_pnl"] - realized_pnl) > 1e-6:
+        problems.append("running P&L totals do not match the transactions")
+    print(f"{completed} trades from {processes} processes ({gave_up} gave up after repeated conflicts), "
+          f"account at version {stored['version']}")
+    return problems
+
+
+def summarize(latencies: list[float]) -> str:
+    ordered = sorted(latencies)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+    return (f"{len(latencies) / sum(latencies):,.0f} trades/s, "
+            f"p50 {percentile(0.50):.2f}ms, p95 {percentile(0.95):.2f}ms, p99 {percentile(0.99):.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trades", type=int, default=1000, help="number of trades to run (per process with --stress)")
+    parser.add_argument("--stress", type=int, metavar="PROCESSES", help="trade one account from this many processes and reconcile")
+    args = parser.parse_args()
+
+    print(f"Scratch database: {use_scratch_database()}")
+    if args.stress:
+        problems = stress(args.stress, args.trades)
+        for problem in problems:
+            print(f"MISMATCH: {problem}")
+        print("Reconciled" if not problems else "Did not reconcile")
+        sys.exit(1 if problems else 0)
+    print(f"{args.trades} trades: {summarize(bench_trades(args.trades))}")
+
+
+if __name__ == "__main__":
+    main()
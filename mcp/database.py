@@ -1,20 +1,336 @@
 import sqlite3
 import json
 import os
-from datetime import datetime
+import atexit
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 
 load_dotenv(override=True)
 
 # Use absolute path for database to work regardless of working directory
 _db_dir = os.path.dirname(os.path.abspath(__file__))
-DB = os.path.join(_db_dir, "accounts.db")
+DB = os.getenv("ACCOUNTS_DB") or os.path.join(_db_dir, "accounts.db")
 
+# Portfolio values are kept raw for a short while and rolled up into OHLC buckets
+# as they are written. Each resolution is kept for this many days (None: forever),
+# and a background thread prunes expired rows every PORTFOLIO_PRUNE_INTERVAL seconds.
+PORTFOLIO_RESOLUTIONS = {"minute": 60, "hour": 3600, "day": 86400}
+PORTFOLIO_RETENTION_DAYS = {"raw": 7, "minute": 30, "hour": 730, "day": None}
+PORTFOLIO_PRUNE_INTERVAL = 3600
+PORTFOLIO_MAX_POINTS = 2000
 
-with sqlite3.connect(DB) as conn:
-    cursor = conn.cursor()
-    cursor.execute('CREATE TABLE IF NOT EXISTS accounts (name TEXT PRIMARY KEY, account TEXT)')
-    cursor.execute('''
+# Each thread keeps one long-lived connection, so sqlite's per-connection
+# statement cache is reused across calls instead of being rebuilt every time
+_local = threading.local()
+_connections: list[sqlite3.Connection] = []
+_connections_lock = threading.Lock()
+
+
+class VersionConflict(Exception):
+    """An account was written by someone else after the version a caller expected to replace."""
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB, timeout=30, cached_statements=256, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Return the calling thread's connection, opening it on first use.
+
+    Write through unit_of_work() rather than using the connection as a context manager,
+    so the write can join a larger unit of work.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _connect()
+        _local.conn = conn
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+
+@contextmanager
+def unit_of_work():
+    """
+    Commit everything written inside the block at once, or roll it all back on error.
+
+    Every write function here runs in a unit of work, so calling them inside an
+    outer one makes them part of its single commit instead of committing on their own.
+    """
+    conn = get_connection()
+    if getattr(_local, "in_unit_of_work", False):
+        yield conn
+        return
+    _local.in_unit_of_work = True
+    try:
+        with conn:
+            yield conn
+    finally:
+        _local.in_unit_of_work = False
+
+
+@contextmanager
+def read_snapshot():
+    """Run several reads against one consistent view of the database, unless a transaction is already open."""
+    conn = get_connection()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute('BEGIN')
+    try:
+        yield conn
+    finally:
+        conn.execute('COMMIT')
+
+
+@atexit.register
+def close_connections() -> None:
+    """Close every pooled connection; safe to call more than once."""
+    with _connections_lock:
+        while _connections:
+            _connections.pop().close()
+    _local.__dict__.clear()
+
+
+def _insert_account(conn: sqlite3.Connection, name: str, account_dict: dict, expected_version: int | None = None) -> int:
+    """Replace every row belonging to one account with the contents of account_dict, returning its new version."""
+    # Transactions come as dicts from JSON and model_dump, or as (symbol, quantity, price, timestamp, rationale) rows from read_account
+    transactions = [
+        (t["symbol"], t["quantity"], t["price"], t["timestamp"], t["rationale"]) if isinstance(t, dict) else tuple(t)
+        for t in account_dict["transactions"]
+    ]
+    if "net_invested" in account_dict:
+        net_invested, realized_pnl = account_dict["net_invested"], account_dict["realized_pnl"]
+        cost_basis = account_dict["cost_basis"]
+    else:
+        # Written before running totals were kept, so rebuild them from the trade history
+        net_invested, realized_pnl, cost_basis = _replay_accounting(row[:3] for row in transactions)
+    row = conn.execute('''
+        INSERT INTO accounts (name, balance, strategy, net_invested, realized_pnl, version)
+        VALUES (?, ?, ?, ?, ?, 1)
+        ON CONFLICT(name) DO UPDATE SET balance=excluded.balance, strategy=excluded.strategy,
+            net_invested=excluded.net_invested, realized_pnl=excluded.realized_pnl, version=version + 1
+        WHERE ? IS NULL OR version = ?
+        RETURNING version
+    ''', (name, account_dict["balance"], account_dict["strategy"], net_invested, realized_pnl,
+          expected_version, expected_version)).fetchone()
+    if row is None:
+        raise VersionConflict(f"Account {name} has changed since version {expected_version}")
+    version = row[0]
+    for table in ("holdings", "transactions", "portfolio_values"):
+        conn.execute(f'DELETE FROM {table} WHERE name = ?', (name,))
+    conn.executemany(
+        'INSERT INTO holdings (name, symbol, quantity, cost_basis) VALUES (?, ?, ?, ?)',
+        [(name, symbol, quantity, cost_basis.get(symbol, 0.0)) for symbol, quantity in account_dict["holdings"].items()],
+    )
+    conn.executemany(
+        'INSERT INTO transactions (name, symbol, quantity, price, timestamp, rationale) VALUES (?, ?, ?, ?, ?, ?)',
+        [(name, *t) for t in transactions],
+    )
+    conn.executemany(
+        'INSERT INTO portfolio_values (name, datetime, value) VALUES (?, ?, ?)',
+        [(name, point[0], point[1]) for point in account_dict["portfolio_value_time_series"]],
+    )
+    _rebuild_buckets(conn, name, account_dict["portfolio_value_time_series"])
+    return version
+
+
+def _replay_accounting(transactions) -> tuple[float, float, dict[str, float]]:
+    """
+    Rebuild the running totals from (symbol, quantity, price) trades in the order they happened.
+
+    Returns:
+        tuple: (net_invested, realized_pnl, cost_basis) where cost_basis maps each held
+        symbol to the average cost of the shares still held
+    """
+    net_invested = realized_pnl = 0.0
+    cost_basis: dict[str, float] = {}
+    held: dict[str, int] = {}
+    for symbol, quantity, price in transactions:
+        net_invested += quantity * price
+        shares = held.get(symbol, 0)
+        if quantity > 0:
+            cost_basis[symbol] = cost_basis.get(symbol, 0.0) + quantity * price
+        elif shares:
+            cost_sold = cost_basis.get(symbol, 0.0) * -quantity / shares
+            cost_basis[symbol] = cost_basis.get(symbol, 0.0) - cost_sold
+            realized_pnl += -quantity * price - cost_sold
+        held[symbol] = shares + quantity
+    return net_invested, realized_pnl, {symbol: cost for symbol, cost in cost_basis.items() if held[symbol] > 0}
+
+
+def _add_running_totals(conn: sqlite3.Connection) -> None:
+    """Add the cost basis and P&L columns to older databases and fill them in from the trade history."""
+    if "net_invested" in [row[1] for row in conn.execute('PRAGMA table_info(accounts)')]:
+        return
+    conn.execute('BEGIN')
+    conn.execute('ALTER TABLE accounts ADD COLUMN net_invested REAL NOT NULL DEFAULT 0')
+    conn.execute('ALTER TABLE accounts ADD COLUMN realized_pnl REAL NOT NULL DEFAULT 0')
+    conn.execute('ALTER TABLE holdings ADD COLUMN cost_basis REAL NOT NULL DEFAULT 0')
+    for (name,) in conn.execute('SELECT name FROM accounts').fetchall():
+        trades = conn.execute('SELECT symbol, quantity, price FROM transactions WHERE name = ? ORDER BY id', (name,))
+        net_invested, realized_pnl, cost_basis = _replay_accounting(trades)
+        conn.execute('UPDATE accounts SET net_invested = ?, realized_pnl = ? WHERE name = ?', (net_invested, realized_pnl, name))
+        conn.executemany('UPDATE holdings SET cost_basis = ? WHERE name = ? AND symbol = ?',
+                         [(cost, name, symbol) for symbol, cost in cost_basis.items()])
+
+
+def _add_version(conn: sqlite3.Connection) -> None:
+    """Add the version stamp to older databases; every write to an account increments it."""
+    if "version" not in [row[1] for row in conn.execute('PRAGMA table_info(accounts)')]:
+        conn.execute('ALTER TABLE accounts ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+
+
+def _migrate_json_accounts(conn: sqlite3.Connection) -> None:
+    """Move accounts stored as one JSON blob per row into the normalized tables."""
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(accounts)')]
+    if "account" not in columns:
+        return
+    conn.execute('BEGIN')
+    conn.execute('ALTER TABLE accounts RENAME TO accounts_json')
+    _create_account_tables(conn)
+    for name, account_json in conn.execute('SELECT name, account FROM accounts_json').fetchall():
+        _insert_account(conn, name, json.loads(account_json))
+    conn.execute('DROP TABLE accounts_json')
+
+
+def _migrate_json_market(conn: sqlite3.Connection) -> None:
+    """Split the old one-JSON-blob-per-day market table into market_prices rows."""
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'market'").fetchone():
+        return
+    for date, data_json in conn.execute('SELECT date, data FROM market').fetchall():
+        _insert_market(conn, date, json.loads(data_json))
+    conn.execute('DROP TABLE market')
+
+
+def _insert_market(conn: sqlite3.Connection, date: str, data: dict) -> None:
+    conn.execute('DELETE FROM market_prices WHERE date = ?', (date,))
+    conn.executemany(
+        'INSERT INTO market_prices (date, symbol, close) VALUES (?, ?, ?)',
+        [(date, symbol, close) for symbol, close in data.items() if close is not None],
+    )
+
+
+def _bucket_start(datetime: str, resolution: str) -> str:
+    """The start of the bucket a "YYYY-MM-DD HH:MM:SS" time falls in, in the same format."""
+    if resolution == "minute":
+        return datetime[:16] + ":00"
+    if resolution == "hour":
+        return datetime[:13] + ":00:00"
+    return datetime[:10] + " 00:00:00"
+
+
+def _roll_up(conn: sqlite3.Connection, name: str, points) -> None:
+    """Fold (datetime, value) points, oldest first, into the account's minute, hour and day buckets."""
+    conn.executemany('''
+        INSERT INTO portfolio_value_buckets (name, resolution, bucket, open, high, low, close, count)
+        VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+        ON CONFLICT(name, resolution, bucket) DO UPDATE SET
+            high = max(high, excluded.high), low = min(low, excluded.low), close = excluded.close, count = count + 1
+    ''', [(name, resolution, _bucket_start(datetime, resolution), value, value, value, value)
+          for datetime, value in points for resolution in PORTFOLIO_RESOLUTIONS])
+
+
+def _rebuild_buckets(conn: sqlite3.Connection, name: str, points) -> None:
+    """
+    Replace the account's buckets from its raw points. Buckets before the first raw point
+    outlive pruning of the raw rows, so only those from its bucket onward are rebuilt.
+    """
+    if not points:
+        conn.execute('DELETE FROM portfolio_value_buckets WHERE name = ?', (name,))
+        return
+    for resolution in PORTFOLIO_RESOLUTIONS:
+        conn.execute('DELETE FROM portfolio_value_buckets WHERE name = ? AND resolution = ? AND bucket >= ?',
+                     (name, resolution, _bucket_start(points[0][0], resolution)))
+    _roll_up(conn, name, points)
+
+
+def _backfill_buckets(conn: sqlite3.Connection) -> None:
+    """Build the buckets for databases that only have raw portfolio values."""
+    if conn.execute('SELECT 1 FROM portfolio_value_buckets LIMIT 1').fetchone():
+        return
+    points: dict[str, list] = {}
+    for name, datetime, value in conn.execute('SELECT name, datetime, value FROM portfolio_values ORDER BY id'):
+        points.setdefault(name, []).append((datetime, value))
+    for name, series in points.items():
+        _roll_up(conn, name, series)
+
+
+def _create_account_tables(conn: sqlite3.Connection) -> None:
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS accounts (
+            name TEXT PRIMARY KEY,
+            balance REAL NOT NULL,
+            strategy TEXT NOT NULL DEFAULT '',
+            net_invested REAL NOT NULL DEFAULT 0,
+            realized_pnl REAL NOT NULL DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 1
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS holdings (
+            name TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            cost_basis REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (name, symbol)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            price REAL NOT NULL,
+            timestamp TEXT NOT NULL,
+            rationale TEXT NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_name ON transactions (name, id)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS portfolio_values (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            datetime TEXT NOT NULL,
+            value REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_portfolio_values_name ON portfolio_values (name, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_portfolio_values_name_datetime ON portfolio_values (name, datetime)')
+    # For pruning expired history across every account
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_portfolio_values_datetime ON portfolio_values (datetime)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS portfolio_value_buckets (
+            name TEXT NOT NULL,
+            resolution TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            open REAL NOT NULL,
+            high REAL NOT NULL,
+            low REAL NOT NULL,
+            close REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (name, resolution, bucket)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_portfolio_value_buckets_resolution ON portfolio_value_buckets (resolution, bucket)')
+
+
+with get_connection() as conn:
+    _migrate_json_accounts(conn)
+    _create_account_tables(conn)
+    _add_running_totals(conn)
+    _add_version(conn)
+    _backfill_buckets(conn)
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS logs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT,
@@ -23,82 +339,511 @@ with sqlite3.connect(DB) as conn:
             message TEXT
         )
     ''')
-    cursor.execute('CREATE TABLE IF NOT EXISTS market (date TEXT PRIMARY KEY, data TEXT)')
-    conn.commit()
-
-def write_account(name, account_dict):
-    json_data = json.dumps(account_dict)
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO accounts (name, account)
-            VALUES (?, ?)
-            ON CONFLICT(name) DO UPDATE SET account=excluded.account
-        ''', (name.lower(), json_data))
-        conn.commit()
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_logs_name_datetime ON logs (name, datetime, id)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS market_prices (
+            date TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            close REAL NOT NULL,
+            PRIMARY KEY (date, symbol)
+        ) WITHOUT ROWID
+    ''')
+    _migrate_json_market(conn)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS latest_prices (
+            symbol TEXT PRIMARY KEY,
+            price REAL NOT NULL,
+            updated REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+def write_account(name, account_dict, expected_version: int | None = None) -> int:
+    """
+    Write a whole account, replacing its holdings, transactions and portfolio history.
+
+    Args:
+        name: The account name
+        account_dict: The account's fields, as read_account returns them
+        expected_version: Only write if the stored account is still at this version; 0 only creates an account
+            that does not exist yet, and None writes unconditionally
+
+    Returns:
+        int: The account's new version
+
+    Raises:
+        VersionConflict: If the account has been written since expected_version
+    """
+    with unit_of_work() as conn:
+        return _insert_account(conn, name.lower(), account_dict, expected_version)
 
 def read_account(name):
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT account FROM accounts WHERE name = ?', (name.lower(),))
-        row = cursor.fetchone()
-        return json.loads(row[0]) if row else None
-    
+    """The whole account: its summary plus transaction history and portfolio value time series."""
+    # One snapshot, so the version always describes exactly the rows returned with it
+    with read_snapshot():
+        account = read_account_summary(name)
+        if account is None:
+            return None
+        # (symbol, quantity, price, timestamp, rationale) rows, which accounts.py loads straight into a TransactionLedger
+        account["transactions"] = read_transactions(name)
+        account["portfolio_value_time_series"] = read_portfolio_values(name)
+    return account
+
+def read_account_summary(name: str) -> dict | None:
+    """Everything about an account except its history, so the cost does not grow with the number of trades."""
+    name = name.lower()
+    with read_snapshot() as conn:
+        row = conn.execute('SELECT balance, strategy, net_invested, realized_pnl, version FROM accounts WHERE name = ?', (name,)).fetchone()
+        if not row:
+            return None
+        holdings = conn.execute('SELECT symbol, quantity, cost_basis FROM holdings WHERE name = ?', (name,)).fetchall()
+    return {
+        "name": name,
+        "balance": row[0],
+        "strategy": row[1],
+        "net_invested": row[2],
+        "realized_pnl": row[3],
+        "version": row[4],
+        "holdings": {symbol: quantity for symbol, quantity, _ in holdings},
+        "cost_basis": {symbol: cost for symbol, _, cost in holdings},
+    }
+
+def read_transactions(name: str) -> list[tuple]:
+    """An account's trades in order, as (symbol, quantity, price, timestamp, rationale) rows."""
+    return get_connection().execute('''
+        SELECT symbol, quantity, price, timestamp, rationale FROM transactions
+        WHERE name = ?
+        ORDER BY id
+    ''', (name.lower(),)).fetchall()
+
+def read_transactions_page(name: str, before: int | None = None, limit: int = 50):
+    """
+    Read one page of an account's trades, newest first.
+
+    Pages are found by seeking the (name, id) index, so the cost of a page does not
+    depend on how many trades the account has made.
+
+    Args:
+        name (str): The account name
+        before (int): Cursor returned by the previous page, or None to start from the newest trade
+        limit (int): Maximum number of trades to return
+
+    Returns:
+        tuple: (rows, cursor) where rows are (symbol, quantity, price, timestamp, rationale) tuples and
+        cursor is passed as `before` to get the next older page, or None when there are no more
+    """
+    if limit <= 0:
+        return [], None
+    rows = get_connection().execute('''
+        SELECT id, symbol, quantity, price, timestamp, rationale FROM transactions
+        WHERE name = ? AND id < ?
+        ORDER BY id DESC
+        LIMIT ?
+    ''', (name.lower(), before if before is not None else 2 ** 63 - 1, limit)).fetchall()
+    cursor = rows[-1][0] if len(rows) == limit else None
+    return [row[1:] for row in rows], cursor
+
+def read_portfolio_values(name: str) -> list[tuple]:
+    """An account's portfolio value history in order, as (datetime, value) rows."""
+    return get_connection().execute('''
+        SELECT datetime, value FROM portfolio_values
+        WHERE name = ?
+        ORDER BY id
+    ''', (name.lower(),)).fetchall()
+
+def read_held_symbols() -> list[str]:
+    """Every symbol held by at least one account."""
+    return [row[0] for row in get_connection().execute('SELECT DISTINCT symbol FROM holdings WHERE quantity != 0')]
+
+def read_account_version(name: str) -> int | None:
+    """The account's version stamp, or None if it does not exist; a cheap check for whether a cached copy is current."""
+    row = get_connection().execute('SELECT version FROM accounts WHERE name = ?', (name.lower(),)).fetchone()
+    return row[0] if row else None
+
+def _bump_version(conn: sqlite3.Connection, name: str, expected_version: int | None) -> int:
+    """Increment the account's version, first checking it is still expected_version when one is given."""
+    row = conn.execute('''
+        UPDATE accounts SET version = version + 1
+        WHERE name = ? AND (? IS NULL OR version = ?)
+        RETURNING version
+    ''', (name, expected_version, expected_version)).fetchone()
+    if row is None:
+        raise VersionConflict(f"Account {name} has changed since version {expected_version}")
+    return row[0]
+
+def write_account_summary(name: str, balance: float, strategy: str, expected_version: int | None = None) -> int:
+    """Update only the scalar fields of an existing account; returns the new version."""
+    name = name.lower()
+    with unit_of_work() as conn:
+        version = _bump_version(conn, name, expected_version)
+        conn.execute('UPDATE accounts SET balance = ?, strategy = ? WHERE name = ?', (balance, strategy, name))
+        return version
+
+def write_trade(name: str, balance: float, net_invested: float, realized_pnl: float,
+                symbol: str, quantity_held: int, cost_basis: float, transaction: dict,
+                expected_version: int | None = None) -> int:
+    """
+    Record one trade in a single commit: the account's new totals, the holding it changed and the transaction itself.
+
+    Args:
+        name (str): The account name
+        balance (float): Cash balance after the trade
+        net_invested (float): Running total of buy costs less sale proceeds
+        realized_pnl (float): Running total of profit realized on sales
+        symbol (str): The symbol traded
+        quantity_held (int): Shares of symbol held after the trade; 0 removes the holding
+        cost_basis (float): Cost of the shares of symbol still held
+        transaction (dict): The transaction fields (symbol, quantity, price, timestamp, rationale)
+        expected_version (int): Only write if the account is still at this version; None writes unconditionally
+
+    Returns:
+        int: The account's new version
+
+    Raises:
+        VersionConflict: If the account has been written since expected_version
+    """
+    name = name.lower()
+    with unit_of_work() as conn:
+        version = _bump_version(conn, name, expected_version)
+        conn.execute('UPDATE accounts SET balance = ?, net_invested = ?, realized_pnl = ? WHERE name = ?',
+                     (balance, net_invested, realized_pnl, name))
+        if quantity_held:
+            conn.execute('''
+                INSERT INTO holdings (name, symbol, quantity, cost_basis)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(name, symbol) DO UPDATE SET quantity=excluded.quantity, cost_basis=excluded.cost_basis
+            ''', (name, symbol, quantity_held, cost_basis))
+        else:
+            conn.execute('DELETE FROM holdings WHERE name = ? AND symbol = ?', (name, symbol))
+        conn.execute('''
+            INSERT INTO transactions (name, symbol, quantity, price, timestamp, rationale)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (name, transaction["symbol"], transaction["quantity"], transaction["price"],
+              transaction["timestamp"], transaction["rationale"]))
+    return version
+
+def write_portfolio_value(name: str, datetime: str, value: float, expected_version: int | None = None) -> int:
+    """Append one point to an account's portfolio value history and its buckets; returns the account's new version."""
+    name = name.lower()
+    with unit_of_work() as conn:
+        conn.execute('INSERT INTO portfolio_values (name, datetime, value) VALUES (?, ?, ?)', (name, datetime, value))
+        _roll_up(conn, name, [(datetime, value)])
+        version = _bump_version(conn, name, expected_version)
+    _start_pruner()
+    return version
+
+def prune_portfolio_values(now: datetime | None = None) -> None:
+    """
+    Drop raw points and buckets older than PORTFOLIO_RETENTION_DAYS allows, for every account.
+
+    Each resolution is deleted in its own short transaction, found through the datetime and
+    (resolution, bucket) indexes, so writers are only held up for one range delete at a time.
+    """
+    now = now or datetime.now()
+    for resolution, days in PORTFOLIO_RETENTION_DAYS.items():
+        if days is None:
+            continue
+        cutoff = (now - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+        with unit_of_work() as conn:
+            if resolution == "raw":
+                conn.execute('DELETE FROM portfolio_values WHERE datetime < ?', (cutoff,))
+            else:
+                conn.execute('DELETE FROM portfolio_value_buckets WHERE resolution = ? AND bucket < ?', (resolution, cutoff))
+
+# Expired history is pruned by a background thread, started by the first portfolio value
+# written in the process, so no trade's transaction ever includes the prune
+_pruner = None
+_pruner_lock = threading.Lock()
+
+def _start_pruner() -> None:
+    global _pruner
+    if _pruner is None:
+        with _pruner_lock:
+            if _pruner is None:
+                _pruner = threading.Thread(target=_prune_periodically, name="portfolio-pruner", daemon=True)
+                _pruner.start()
+
+def _prune_periodically() -> None:
+    while True:
+        try:
+            prune_portfolio_values()
+        except sqlite3.Error as e:
+            print(f"Was not able to prune portfolio value history due to {e}")
+        time.sleep(PORTFOLIO_PRUNE_INTERVAL)
+
+def choose_portfolio_resolution(name: str, start: str | None = None, end: str | None = None,
+                                max_points: int = PORTFOLIO_MAX_POINTS) -> str:
+    """
+    The finest resolution that still covers start (retention allowing) in at most max_points points:
+    the raw points if there are few enough of them, otherwise the smallest buckets that fit.
+
+    Args:
+        name: The account name; when start is None the range begins at its first day bucket
+        start: First time of the range, "YYYY-MM-DD HH:MM:SS"
+        end: Last time of the range, or None for now
+        max_points: Most points or buckets the range may span
+    """
+    now = datetime.now()
+    if start is None:
+        start = read_portfolio_value_start(name, "day") or now.strftime("%Y-%m-%d %H:%M:%S")
+    if datetime.fromisoformat(start) >= now - timedelta(days=PORTFOLIO_RETENTION_DAYS["raw"]):
+        raw_points = get_connection().execute('''
+            SELECT COUNT(*) FROM (
+                SELECT 1 FROM portfolio_values WHERE name = ? AND datetime >= ? AND datetime <= ? LIMIT ?
+            )
+        ''', (name.lower(), start, end or "9999", max_points + 1)).fetchone()[0]
+        if raw_points <= max_points:
+            return "raw"
+    span = ((datetime.fromisoformat(end) if end else now) - datetime.fromisoformat(start)).total_seconds()
+    for resolution, seconds in PORTFOLIO_RESOLUTIONS.items():
+        days = PORTFOLIO_RETENTION_DAYS[resolution]
+        retained = days is None or datetime.fromisoformat(start) >= now - timedelta(days=days)
+        if retained and span / seconds <= max_points:
+            return resolution
+    return "day"
+
+def read_portfolio_value_start(name: str, resolution: str = "raw") -> str | None:
+    """When the account's stored history begins at a resolution ("raw" or one of PORTFOLIO_RESOLUTIONS)."""
+    conn = get_connection()
+    if resolution == "raw":
+        row = conn.execute('SELECT MIN(datetime) FROM portfolio_values WHERE name = ?', (name.lower(),)).fetchone()
+    else:
+        row = conn.execute('SELECT MIN(bucket) FROM portfolio_value_buckets WHERE name = ? AND resolution = ?',
+                           (name.lower(), resolution)).fetchone()
+    return row[0]
+
+def read_portfolio_value_range(name: str, start: str | None = None, end: str | None = None,
+                               resolution: str | None = None, max_points: int = PORTFOLIO_MAX_POINTS) -> tuple[str, list[tuple]]:
+    """
+    Read an account's portfolio value history between start and end at one resolution.
+
+    Args:
+        name: The account name
+        start: First time to include, "YYYY-MM-DD HH:MM:SS", or None from the beginning; a bucket
+            that start falls inside is included
+        end: Last time to include, or None up to now
+        resolution: "raw", "minute", "hour" or "day"; None picks one with choose_portfolio_resolution
+        max_points: Most points an automatically chosen resolution may return
+
+    Returns:
+        tuple: (resolution, rows) where rows are (datetime, open, high, low, close) tuples, oldest first;
+        buckets are keyed by their start time and raw points have all four values equal
+    """
+    name = name.lower()
+    if resolution is None:
+        resolution = choose_portfolio_resolution(name, start, end, max_points)
+    bounds = (start or "", end or "9999")
+    conn = get_connection()
+    if resolution == "raw":
+        rows = conn.execute('''
+            SELECT datetime, value, value, value, value FROM portfolio_values
+            WHERE name = ? AND datetime >= ? AND datetime <= ?
+            ORDER BY datetime, id
+        ''', (name, *bounds)).fetchall()
+    elif resolution in PORTFOLIO_RESOLUTIONS:
+        bounds = (_bucket_start(start, resolution) if start else "", bounds[1])
+        rows = conn.execute('''
+            SELECT bucket, open, high, low, close FROM portfolio_value_buckets
+            WHERE name = ? AND resolution = ? AND bucket >= ? AND bucket <= ?
+            ORDER BY bucket
+        ''', (name, resolution, *bounds)).fetchall()
+    else:
+        raise ValueError(f"Unknown resolution {resolution}; expected raw, {', '.join(PORTFOLIO_RESOLUTIONS)}")
+    return resolution, rows
+
+# Log entries are queued and written by a background thread in batches, so a
+# trade never waits on a log commit. A full queue blocks callers until the
+# writer catches up rather than growing without bound.
+LOG_QUEUE_SIZE = 10_000
+LOG_BATCH_SIZE = 500
+LOG_FLUSH_INTERVAL = 0.5
+
+
+class LogWriter:
+    """Group-commits queued log entries from a single background thread."""
+
+    _STOP = object()
+
+    def __init__(self, maxsize: int = LOG_QUEUE_SIZE, batch_size: int = LOG_BATCH_SIZE, interval: float = LOG_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, entry: tuple) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                    self._thread.start()
+        self._queue.put(entry)
+
+    def flush(self) -> None:
+        """Block until every entry submitted so far has been committed."""
+        if self._thread is None:
+            return
+        # Entries behind the marker do not hold it up, and the writer commits as soon as it sees it
+        flushed = threading.Event()
+        self._queue.put(flushed)
+        flushed.wait()
+
+    def close(self) -> None:
+        """Commit anything still queued and stop the writer thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(self._STOP)
+            thread.join()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while isinstance(batch[-1], tuple) and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            entries = [entry for entry in batch if isinstance(entry, tuple)]
+            try:
+                if entries:
+                    with unit_of_work() as conn:
+                        conn.executemany('''
+                            INSERT INTO logs (name, datetime, type, message)
+                            VALUES (?, ?, ?, ?)
+                        ''', entries)
+            except sqlite3.Error as e:
+                print(f"Was not able to write {len(entries)} log entries due to {e}")
+            finally:
+                for entry in batch:
+                    if isinstance(entry, threading.Event):
+                        entry.set()
+            if batch[-1] is self._STOP:
+                return
+
+
+_log_writer = LogWriter()
+
+
+def flush_logs() -> None:
+    """Block until every queued log entry has been written."""
+    _log_writer.flush()
+
+
+@atexit.register
+def _close_log_writer() -> None:
+    # Registered after close_connections, so it runs first at exit
+    _log_writer.close()
+
+
 def write_log(name: str, type: str, message: str):
     """
-    Write a log entry to the logs table.
+    Queue a log entry for the logs table; it is committed by the background writer.
     
     Args:
         name (str): The name associated with the log
         type (str): The type of log entry
         message (str): The log message
     """
-    now = datetime.now().isoformat()
-    
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO logs (name, datetime, type, message)
-            VALUES (?, datetime('now'), ?, ?)
-        ''', (name.lower(), type, message))
-        conn.commit()
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    _log_writer.submit((name.lower(), now, type, message))
+
+def read_log_page(name: str, before: tuple | None = None, limit: int = 10):
+    """
+    Read one page of log entries for a given name, newest first.
+
+    Pages are found by seeking the (name, datetime, id) index, so the cost of a page
+    does not depend on how many entries come after it.
 
-def read_log(name: str, last_n=10):
+    Args:
+        name (str): The name to retrieve logs for
+        before (tuple): Cursor returned by the previous page, or None to start from the newest entry
+        limit (int): Maximum number of entries to return
+
+    Returns:
+        tuple: (entries, cursor) where entries are (datetime, type, message) tuples and
+        cursor is passed as `before` to get the next older page, or None when there are no more
+    """
+    if limit <= 0:
+        return [], None
+    flush_logs()
+    conn = get_connection()
+    if before is None:
+        rows = conn.execute('''
+            SELECT datetime, id, type, message FROM logs
+            WHERE name = ?
+            ORDER BY datetime DESC, id DESC
+            LIMIT ?
+        ''', (name.lower(), limit)).fetchall()
+    else:
+        rows = conn.execute('''
+            SELECT datetime, id, type, message FROM logs
+            WHERE name = ? AND (datetime, id) < (?, ?)
+            ORDER BY datetime DESC, id DESC
+            LIMIT ?
+        ''', (name.lower(), *before, limit)).fetchall()
+    cursor = (rows[-1][0], rows[-1][1]) if len(rows) == limit else None
+    return [(dt, type, message) for dt, _, type, message in rows], cursor
+
+def read_log(name: str, last_n=10, before: tuple | None = None):
     """
     Read the most recent log entries for a given name.
     
     Args:
         name (str): The name to retrieve logs for
         last_n (int): Number of most recent entries to retrieve
+        before (tuple): Optional cursor from read_log_page; only entries older than it are read
         
     Returns:
         list: A list of tuples containing (datetime, type, message)
     """
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT datetime, type, message FROM logs 
-            WHERE name = ? 
-            ORDER BY datetime DESC
-            LIMIT ?
-        ''', (name.lower(), last_n))
-        
-        return reversed(cursor.fetchall())
+    entries, _ = read_log_page(name, before, last_n)
+    return reversed(entries)
+
+def iter_logs(name: str, before: tuple | None = None, batch_size: int = 500):
+    """
+    Yield every log entry for a given name, newest first, fetching batch_size rows at a time.
+
+    Args:
+        name (str): The name to retrieve logs for
+        before (tuple): Optional cursor from read_log_page to start from
+        batch_size (int): Number of rows read per query
+    """
+    while True:
+        entries, before = read_log_page(name, before, batch_size)
+        yield from entries
+        if before is None:
+            return
 
 def write_market(date: str, data: dict) -> None:
-    data_json = json.dumps(data)
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO market (date, data)
-            VALUES (?, ?)
-            ON CONFLICT(date) DO UPDATE SET data=excluded.data
-        ''', (date, data_json))
-        conn.commit()
+    """Replace the closing prices stored for a date with data, a dict of symbol to close."""
+    with unit_of_work() as conn:
+        _insert_market(conn, date, data)
 
 def read_market(date: str) -> dict | None:
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT data FROM market WHERE date = ?', (date,))
-        row = cursor.fetchone()
-        return json.loads(row[0]) if row else None
\ No newline at end of file
+    rows = get_connection().execute('SELECT symbol, close FROM market_prices WHERE date = ?', (date,)).fetchall()
+    return dict(rows) if rows else None
+
+def write_latest_prices(prices: dict[str, float], updated: float) -> None:
+    """Store the most recently fetched prices (symbol -> price), with the epoch time they were fetched."""
+    with unit_of_work() as conn:
+        conn.executemany('''
+            INSERT INTO latest_prices (symbol, price, updated)
+            VALUES (?, ?, ?)
+            ON CONFLICT(symbol) DO UPDATE SET price=excluded.price, updated=excluded.updated
+        ''', [(symbol, price, updated) for symbol, price in prices.items()])
+
+def read_latest_price(symbol: str) -> tuple[float, float] | None:
+    """Return (price, updated) for a symbol, or None if no price has been stored."""
+    return get_connection().execute('SELECT price, updated FROM latest_prices WHERE symbol = ?', (symbol,)).fetchone()
+
+def delete_latest_prices(symbol: str | None = None) -> None:
+    """Forget the stored price for one symbol, or for every symbol when symbol is None."""
+    with unit_of_work() as conn:
+        if symbol is None:
+            conn.execute('DELETE FROM latest_prices')
+        else:
+            conn.execute('DELETE FROM latest_prices WHERE symbol = ?', (symbol,))
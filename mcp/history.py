@@ -0,0 +1,137 @@
+"""
+Local store of daily OHLCV bars, kept as columnar NumPy arrays per symbol.
+
+Bars are added in bulk (from Polygon aggregates via market.backfill_history, or
+from a CSV or Parquet file) and saved as one .npz file per symbol. Queries slice
+the arrays with binary searches on the date column instead of calling the API.
+"""
+import csv
+import os
+import threading
+import numpy as np
+from snapshots import atomic_open
+
+_history_dir = os.path.dirname(os.path.abspath(__file__))
+HISTORY_DIR = os.getenv("MARKET_HISTORY_DIR") or os.path.join(_history_dir, "market_history")
+
+FIELDS = ("open", "high", "low", "close", "volume")
+
+
+def _as_dates(values) -> np.ndarray:
+    return np.asarray(values, dtype="datetime64[D]")
+
+
+class HistoryStore:
+    """Daily bars per symbol: a sorted datetime64 date column plus one float64 column per field."""
+
+    def __init__(self, directory: str = HISTORY_DIR):
+        self.directory = directory
+        self._bars: dict[str, dict[str, np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, symbol: str) -> str:
+        return os.path.join(self.directory, f"{symbol}.npz")
+
+    def _load(self, symbol: str) -> dict[str, np.ndarray] | None:
+        bars = self._bars.get(symbol)
+        if bars is None and os.path.exists(self._path(symbol)):
+            with np.load(self._path(symbol)) as data:
+                bars = {name: data[name] for name in data.files}
+            self._bars[symbol] = bars
+        return bars
+
+    def symbols(self) -> list[str]:
+        names = set(self._bars)
+        if os.path.isdir(self.directory):
+            names.update(f[:-4] for f in os.listdir(self.directory) if f.endswith(".npz"))
+        return sorted(names)
+
+    def add_bars(self, symbol: str, dates, opens, highs, lows, closes, volumes) -> int:
+        """
+        Merge bars for one symbol into the store and save it; a bar for an existing date replaces it.
+
+        Returns:
+            int: The number of bars now stored for the symbol
+        """
+        new = {"date": _as_dates(dates)}
+        for name, column in zip(FIELDS, (opens, highs, lows, closes, volumes)):
+            new[name] = np.asarray(column, dtype=np.float64)
+        with self._lock:
+            old = self._load(symbol)
+            if old is not None:
+                # New bars first, so np.unique keeps them over the stored bars for the same date
+                new = {name: np.concatenate([new[name], old[name]]) for name in new}
+            _, keep = np.unique(new["date"], return_index=True)
+            bars = {name: column[keep] for name, column in new.items()}
+            os.makedirs(self.directory, exist_ok=True)
+            with atomic_open(self._path(symbol)) as f:
+                np.savez(f, **bars)
+            self._bars[symbol] = bars
+        return len(bars["date"])
+
+    def load_csv(self, path: str) -> dict[str, int]:
+        """
+        Load bars from a CSV file with columns symbol, date, open, high, low, close, volume.
+
+        Returns:
+            dict: symbol -> number of bars stored
+        """
+        with open(path, newline="") as f:
+            rows = list(csv.DictReader(f))
+        return self._add_rows(rows)
+
+    def load_parquet(self, path: str) -> dict[str, int]:
+        """Load bars from a Parquet file with the same columns as load_csv; needs pandas with a Parquet engine."""
+        import pandas as pd
+        return self._add_rows(pd.read_parquet(path).to_dict("records"))
+
+    def _add_rows(self, rows: list[dict]) -> dict[str, int]:
+        by_symbol: dict[str, list[dict]] = {}
+        for row in rows:
+            by_symbol.setdefault(row["symbol"], []).append(row)
+        return {
+            symbol: self.add_bars(symbol, [str(r["date"])[:10] for r in symbol_rows],
+                                  *([float(r[name]) for r in symbol_rows] for name in FIELDS))
+            for symbol, symbol_rows in by_symbol.items()
+        }
+
+    def bars(self, symbol: str, start=None, end=None) -> dict[str, np.ndarray]:
+        """
+        Return the bars for symbol between start and end inclusive, as columns keyed by date and FIELDS.
+
+        Args:
+            symbol: The symbol to read
+            start: First date (a date, datetime64 or "YYYY-MM-DD"), or None for the earliest
+            end: Last date, or None for the latest
+        """
+        bars = self._load(symbol)
+        if bars is None:
+            return {"date": _as_dates([]), **{name: np.empty(0) for name in FIELDS}}
+        lo = 0 if start is None else np.searchsorted(bars["date"], _as_dates(start), side="left")
+        hi = len(bars["date"]) if end is None else np.searchsorted(bars["date"], _as_dates(end), side="right")
+        return {name: column[lo:hi] for name, column in bars.items()}
+
+    def closes(self, symbols: list[str], start=None, end=None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Closing prices for several symbols aligned on a shared date axis.
+
+        Returns:
+            tuple: (dates, closes) where closes has one column per symbol and NaN where a symbol has no bar
+        """
+        columns = [self.bars(symbol, start, end) for symbol in symbols]
+        dates = np.unique(np.concatenate([_as_dates([])] + [bars["date"] for bars in columns]))
+        closes = np.full((len(dates), len(symbols)), np.nan)
+        for i, bars in enumerate(columns):
+            closes[np.searchsorted(dates, bars["date"]), i] = bars["close"]
+        return dates, closes
+
+    def returns(self, symbols: list[str], window: int, end=None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Simple daily returns for several symbols over the last window trading days up to end.
+
+        Returns:
+            tuple: (dates, returns) with one column per symbol; NaN where either close is missing
+        """
+        dates, closes = self.closes(symbols, end=end)
+        dates, closes = dates[-(window + 1):], closes[-(window + 1):]
+        return dates[1:], closes[1:] / closes[:-1] - 1
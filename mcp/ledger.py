@@ -0,0 +1,181 @@
+"""
+An account's transaction history, stored as columns rather than one object per trade.
+
+Symbols and rationales are kept once each in string tables and referenced by id;
+quantity, price and timestamp are NumPy arrays that grow by doubling. Loading a
+history is a handful of array conversions, and each trade is read through a
+TransactionRow view that exposes the same fields as accounts.Transaction.
+"""
+import numpy as np
+
+FIELDS = ("symbol", "quantity", "price", "timestamp", "rationale")
+
+
+def _parse_timestamps(values) -> np.ndarray:
+    # datetime64 accepts both "YYYY-MM-DD HH:MM:SS" and the ISO "T" separator
+    return np.array(values, dtype="datetime64[s]")
+
+
+def _format_timestamps(values: np.ndarray) -> list[str]:
+    strings = np.datetime_as_string(values, unit="s")
+    if len(strings):
+        # Swap the ISO "T" for a space in place, on a one-character-per-cell view of the string array
+        strings.view("U1").reshape(len(strings), -1)[:, 10] = " "
+    return strings.tolist()
+
+
+def _intern(strings, index: dict[str, int]) -> list[int]:
+    """Ids for strings in index, adding any not seen before."""
+    return [index.setdefault(string, len(index)) for string in strings]
+
+
+class TransactionRow:
+    """A read-only view of one trade in a TransactionLedger."""
+
+    __slots__ = ("_ledger", "_index")
+
+    def __init__(self, ledger: "TransactionLedger", index: int):
+        self._ledger = ledger
+        self._index = index
+
+    @property
+    def symbol(self) -> str:
+        return self._ledger.symbols[self._ledger._symbol_ids[self._index]]
+
+    @property
+    def quantity(self) -> int:
+        return int(self._ledger._quantities[self._index])
+
+    @property
+    def price(self) -> float:
+        return float(self._ledger._prices[self._index])
+
+    @property
+    def timestamp(self) -> str:
+        return _format_timestamps(self._ledger._timestamps[self._index:self._index + 1])[0]
+
+    @property
+    def rationale(self) -> str:
+        return self._ledger.rationales[self._ledger._rationale_ids[self._index]]
+
+    def total(self) -> float:
+        return self.quantity * self.price
+
+    def model_dump(self) -> dict:
+        return {field: getattr(self, field) for field in FIELDS}
+
+    def __repr__(self):
+        return f"{abs(self.quantity)} shares of {self.symbol} at {self.price} each."
+
+
+class TransactionLedger:
+    """
+    Append-only columns of trades in the order they happened.
+
+    Build one from read_account rows or a list of transaction dicts with from_records;
+    to_list turns it back into dicts.
+    """
+
+    __slots__ = ("symbols", "rationales", "_symbol_index", "_rationale_index",
+                 "_symbol_ids", "_quantities", "_prices", "_timestamps", "_rationale_ids", "_size")
+
+    def __init__(self, capacity: int = 16):
+        self.symbols: list[str] = []
+        self.rationales: list[str] = []
+        self._symbol_index: dict[str, int] = {}
+        self._rationale_index: dict[str, int] = {}
+        self._symbol_ids = np.empty(capacity, dtype=np.int32)
+        self._quantities = np.empty(capacity, dtype=np.int64)
+        self._prices = np.empty(capacity, dtype=np.float64)
+        self._timestamps = np.empty(capacity, dtype="datetime64[s]")
+        self._rationale_ids = np.empty(capacity, dtype=np.int32)
+        self._size = 0
+
+    @classmethod
+    def from_records(cls, records) -> "TransactionLedger":
+        """
+        Build a ledger from (symbol, quantity, price, timestamp, rationale) rows, transaction dicts or Transactions.
+        """
+        if isinstance(records, cls):
+            return records
+        records = list(records)
+        if records and not isinstance(records[0], (tuple, list)):
+            records = [tuple(record[field] if isinstance(record, dict) else getattr(record, field) for field in FIELDS)
+                       for record in records]
+        ledger = cls(capacity=max(16, len(records)))
+        if records:
+            symbols, quantities, prices, timestamps, rationales = zip(*records)
+            size = len(records)
+            ledger._symbol_ids[:size] = _intern(symbols, ledger._symbol_index)
+            ledger._quantities[:size] = quantities
+            ledger._prices[:size] = prices
+            ledger._timestamps[:size] = _parse_timestamps(timestamps)
+            ledger._rationale_ids[:size] = _intern(rationales, ledger._rationale_index)
+            ledger._size = size
+            ledger.symbols = list(ledger._symbol_index)
+            ledger.rationales = list(ledger._rationale_index)
+        return ledger
+
+    def _grow(self) -> None:
+        capacity = max(16, 2 * len(self._quantities))
+        for name in ("_symbol_ids", "_quantities", "_prices", "_timestamps", "_rationale_ids"):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def append(self, symbol: str, quantity: int, price: float, timestamp: str, rationale: str) -> TransactionRow:
+        """Add a trade to the end of the ledger and return a view of it."""
+        if self._size == len(self._quantities):
+            self._grow()
+        i = self._size
+        self._symbol_ids[i] = _intern((symbol,), self._symbol_index)[0]
+        if len(self._symbol_index) > len(self.symbols):
+            self.symbols.append(symbol)
+        self._quantities[i] = quantity
+        self._prices[i] = price
+        self._timestamps[i] = np.datetime64(timestamp.replace(" ", "T"), "s")
+        self._rationale_ids[i] = _intern((rationale,), self._rationale_index)[0]
+        if len(self._rationale_index) > len(self.rationales):
+            self.rationales.append(rationale)
+        self._size += 1
+        return TransactionRow(self, i)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, index: int) -> TransactionRow:
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("transaction index out of range")
+        return TransactionRow(self, index)
+
+    def __iter__(self):
+        return (TransactionRow(self, i) for i in range(self._size))
+
+    @property
+    def quantities(self) -> np.ndarray:
+        return self._quantities[:self._size]
+
+    @property
+    def prices(self) -> np.ndarray:
+        return self._prices[:self._size]
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self._timestamps[:self._size]
+
+    def symbol_column(self) -> np.ndarray:
+        """The symbol of every trade, as an object array."""
+        return np.array(self.symbols, dtype=object)[self._symbol_ids[:self._size]]
+
+    def to_list(self) -> list[dict]:
+        """Every trade as a dict with the same keys as Transaction.model_dump()."""
+        rationales = np.array(self.rationales, dtype=object)[self._rationale_ids[:self._size]]
+        return [
+            {"symbol": symbol, "quantity": quantity, "price": price, "timestamp": timestamp, "rationale": rationale}
+            for symbol, quantity, price, timestamp, rationale in zip(
+                self.symbol_column().tolist(), self.quantities.tolist(), self.prices.tolist(),
+                _format_timestamps(self.timestamps), rationales.tolist())
+        ]
@@ -1,9 +1,18 @@
 from polygon import RESTClient
 from dotenv import load_dotenv
 import os
+import sys
 from datetime import datetime
-import random
-from database import write_market, read_market
+import threading
+import time
+from concurrent.futures import Future
+from database import write_market, read_market, write_latest_prices, read_latest_price, delete_latest_prices, read_held_symbols
+from snapshots import MarketSnapshot
+from market_simulator import MarketSimulator
+from rate_limiter import RateLimiter
+from market_calendar import MarketCalendar, EASTERN
+from history import HistoryStore
+from price_feed import LastTradeBook, PriceFeed, PolygonWebSocketFeed, ReplayFeed
 from functools import lru_cache
 from datetime import timezone
 
@@ -15,56 +24,435 @@ polygon_plan = os.getenv("POLYGON_PLAN")
 is_paid_polygon = polygon_plan == "paid"
 is_realtime_polygon = polygon_plan == "realtime"
 
+# How long, in seconds, a fetched price may be reused on each Polygon plan
+PRICE_CACHE_TTL = {"eod": 3600.0, "paid": 60.0, "realtime": 1.0}
 
-def is_market_open() -> bool:
-    client = RESTClient(polygon_api_key)
-    market_status = client.get_market_status()
-    return market_status.market == "open"
+# Priorities for Polygon calls when the rate limit is reached: trades go first
+PRIORITY_TRADE = 0
+PRIORITY_VALUATION = 1
+
+# Longest time, in seconds, each priority waits for a rate limit token before falling back
+RATE_LIMIT_WAIT = {PRIORITY_TRADE: 15.0, PRIORITY_VALUATION: 2.0}
+
+# Polygon calls allowed per minute across all endpoints, since the quota is per API key; the free plan allows 5
+POLYGON_CALLS_PER_MINUTE = float(os.getenv("POLYGON_CALLS_PER_MINUTE") or (5 if polygon_plan not in ("paid", "realtime") else 6000))
+
+
+class RateLimited(Exception):
+    """Raised when a Polygon call could not get a rate limit token in time."""
+
+
+class PriceCache:
+    """
+    Per-symbol TTL cache in front of the Polygon lookups.
+
+    The first tier is an in-process dict. When persist is set, fetched prices are
+    also written to the latest_prices table so other server processes can reuse
+    them while they are still fresh.
+    """
+
+    def __init__(self, ttl: float, persist: bool = False):
+        self.ttl = ttl
+        self.persist = persist
+        self.hits = 0
+        self.misses = 0
+        self._prices: dict[str, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, symbol: str) -> float | None:
+        """Return a price fetched within the TTL, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._prices.get(symbol)
+        if self.persist and (entry is None or now - entry[1] > self.ttl):
+            # Another process may have fetched it more recently
+            entry = read_latest_price(symbol) or entry
+        with self._lock:
+            if entry is not None and now - entry[1] <= self.ttl:
+                self._prices[symbol] = entry
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def get_stale(self, symbol: str) -> float | None:
+        """Return the last known price for symbol however old it is, or None."""
+        with self._lock:
+            entry = self._prices.get(symbol)
+        if entry is None and self.persist:
+            entry = read_latest_price(symbol)
+        return entry[0] if entry is not None else None
+
+    def put(self, symbol: str, price: float) -> None:
+        self.put_many({symbol: price})
+
+    def put_many(self, prices: dict[str, float]) -> None:
+        now = time.time()
+        with self._lock:
+            for symbol, price in prices.items():
+                self._prices[symbol] = (price, now)
+        if self.persist and prices:
+            write_latest_prices(prices, now)
+
+    def invalidate(self, symbol: str | None = None) -> None:
+        """Drop the cached price for one symbol, or every cached price when symbol is None."""
+        with self._lock:
+            if symbol is None:
+                self._prices.clear()
+            else:
+                self._prices.pop(symbol, None)
+        if self.persist:
+            delete_latest_prices(symbol)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._prices), "ttl": self.ttl}
+
+
+# Connections kept alive to api.polygon.io, enough for concurrent trader sessions
+POLYGON_POOL_SIZE = 10
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> RESTClient:
+    """Return the process-wide Polygon client, so every call reuses its pooled keep-alive connections."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                client = RESTClient(polygon_api_key)
+                # urllib3 keeps only one idle connection per host unless told otherwise
+                client.client.connection_pool_kw["maxsize"] = POLYGON_POOL_SIZE
+                _client = client
+    return _client
+
+
+class SingleFlight:
+    """Collapses concurrent calls that share a key into one call whose result every caller gets."""
+
+    def __init__(self):
+        self._calls: dict = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+_in_flight = SingleFlight()
+
+# Any one endpoint may use the whole budget, but all of them together draw from one total bucket
+rate_limiter = RateLimiter(rate=POLYGON_CALLS_PER_MINUTE / 60, capacity=min(POLYGON_CALLS_PER_MINUTE, 100),
+                           total=(POLYGON_CALLS_PER_MINUTE / 60, min(POLYGON_CALLS_PER_MINUTE, 100)))
+
+
+def _polygon_call(endpoint: str, priority: int, fn, *args):
+    """Make one Polygon call once the endpoint's and the API key's rate limits allow it."""
+    if not rate_limiter.acquire(endpoint, priority, timeout=RATE_LIMIT_WAIT[priority]):
+        raise RateLimited(f"Polygon rate limit reached for {endpoint}")
+    return fn(*args)
+
+
+price_cache = PriceCache(
+    ttl=float(os.getenv("PRICE_CACHE_TTL") or PRICE_CACHE_TTL.get(polygon_plan, PRICE_CACHE_TTL["eod"])),
+    persist=os.getenv("PRICE_CACHE_PERSIST", "").lower() in ("1", "true", "yes"),
+)
+
+
+@lru_cache(maxsize=1)
+def _market_calendar_for(day: str) -> MarketCalendar:
+    holidays = []
+    if polygon_api_key:
+        try:
+            holidays = _in_flight.do("market_holidays", _polygon_call, "market_holidays", PRIORITY_VALUATION, get_client().get_market_holidays)
+        except Exception as e:
+            print(f"Was not able to fetch market holidays due to {e}; assuming regular sessions")
+    return MarketCalendar.from_polygon_holidays(holidays)
+
+
+def get_market_calendar() -> MarketCalendar:
+    """Return today's market calendar; holidays are fetched from Polygon at most once a day."""
+    return _market_calendar_for(datetime.now(EASTERN).date().isoformat())
 
 
 def get_all_share_prices_polygon_eod() -> dict[str, float]:
     """With much thanks to student Reema R. for fixing the timezone issue with this!"""
-    client = RESTClient(polygon_api_key)
+    client = get_client()
 
-    probe = client.get_previous_close_agg("SPY")[0]
+    probe = _polygon_call("previous_close", PRIORITY_TRADE, client.get_previous_close_agg, "SPY")[0]
     last_close = datetime.fromtimestamp(probe.timestamp / 1000, tz=timezone.utc).date()
 
-    results = client.get_grouped_daily_aggs(last_close, adjusted=True, include_otc=False)
+    results = _polygon_call("grouped_daily", PRIORITY_TRADE, lambda: client.get_grouped_daily_aggs(last_close, adjusted=True, include_otc=False))
     return {result.ticker: result.close for result in results}
 
 
 @lru_cache(maxsize=2)
-def get_market_for_prior_date(today):
-    market_data = read_market(today)
-    if not market_data:
-        market_data = get_all_share_prices_polygon_eod()
-        write_market(today, market_data)
-    return market_data
+def get_market_for_prior_date(today) -> MarketSnapshot:
+    # lru_cache does not stop two threads missing at once, so share the load between them
+    return _in_flight.do(("eod", today), _load_market_for_prior_date, today)
+
+
+def _load_market_for_prior_date(today) -> MarketSnapshot:
+    snapshot = MarketSnapshot.open(today)
+    if snapshot is None:
+        market_data = read_market(today)
+        if not market_data:
+            market_data = get_all_share_prices_polygon_eod()
+            write_market(today, market_data)
+        snapshot = MarketSnapshot.write(today, market_data)
+    return snapshot
 
 
 def get_share_price_polygon_eod(symbol) -> float:
     today = datetime.now().date().strftime("%Y-%m-%d")
-    market_data = get_market_for_prior_date(today)
-    return market_data.get(symbol, 0.0)
+    return get_market_for_prior_date(today).get(symbol, 0.0)
 
 
-def get_share_price_polygon_min(symbol) -> float:
-    client = RESTClient(polygon_api_key)
-    result = client.get_snapshot_ticker("stocks", symbol)
+def get_share_price_polygon_min(symbol, priority: int = PRIORITY_TRADE) -> float:
+    result = _in_flight.do(("min", symbol), _polygon_call, "snapshot", priority, get_client().get_snapshot_ticker, "stocks", symbol)
     return result.min.close or result.prev_day.close
 
 
-def get_share_price_polygon(symbol) -> float:
+def get_share_prices_polygon_min(symbols: list[str], priority: int = PRIORITY_VALUATION) -> dict[str, float]:
+    """Fetch minute snapshots for many tickers in one request; unknown tickers are left out."""
+    results = _in_flight.do(("min", tuple(sorted(symbols))), _polygon_call, "snapshot", priority, get_client().get_snapshot_all, "stocks", symbols)
+    return {result.ticker: (result.min.close if result.min else None) or result.prev_day.close for result in results}
+
+
+def get_share_prices_polygon_eod(symbols: list[str]) -> dict[str, float]:
+    today = datetime.now().date().strftime("%Y-%m-%d")
+    closes = get_market_for_prior_date(today).prices_for(symbols)
+    return {symbol: float(close) if close == close else 0.0 for symbol, close in zip(symbols, closes)}
+
+
+def get_share_prices_polygon(symbols: list[str], priority: int = PRIORITY_VALUATION) -> dict[str, float]:
     if is_paid_polygon:
-        return get_share_price_polygon_min(symbol)
+        return get_share_prices_polygon_min(symbols, priority)
+    else:
+        return get_share_prices_polygon_eod(symbols)
+
+
+def get_share_price_polygon(symbol, priority: int = PRIORITY_TRADE) -> float:
+    if is_paid_polygon:
+        return get_share_price_polygon_min(symbol, priority)
     else:
         return get_share_price_polygon_eod(symbol)
 
 
-def get_share_price(symbol) -> float:
-    if polygon_api_key:
+history = HistoryStore()
+
+
+def backfill_history(symbols: list[str], start, end) -> dict[str, int]:
+    """
+    Fetch daily bars for symbols from Polygon aggregates into the local history store.
+
+    Args:
+        symbols: The symbols to backfill
+        start: First date to fetch ("YYYY-MM-DD" or a date)
+        end: Last date to fetch
+
+    Returns:
+        dict: symbol -> number of bars now stored
+    """
+    client = get_client()
+    counts = {}
+    for symbol in symbols:
+        aggs = _polygon_call("aggregates", PRIORITY_VALUATION,
+                             lambda: list(client.list_aggs(symbol, 1, "day", start, end, adjusted=True, limit=50000)))
+        if not aggs:
+            continue
+        dates = [datetime.fromtimestamp(agg.timestamp / 1000, tz=timezone.utc).date() for agg in aggs]
+        counts[symbol] = history.add_bars(symbol, dates, *([getattr(agg, name) for agg in aggs] for name in ("open", "high", "low", "close", "volume")))
+    return counts
+
+
+class PolygonBackend:
+    """Prices from the Polygon API, on the plan set by POLYGON_PLAN."""
+
+    cached = True
+
+    def get_share_price(self, symbol: str, priority: int = PRIORITY_TRADE) -> float:
+        return get_share_price_polygon(symbol, priority)
+
+    def get_share_prices(self, symbols: list[str], priority: int = PRIORITY_VALUATION) -> dict[str, float]:
+        return get_share_prices_polygon(symbols, priority)
+
+    def is_market_open(self, at: datetime | None = None) -> bool:
+        return get_market_calendar().is_open(at)
+
+
+# Offline prices: used as the backend when there is no Polygon key (or MARKET_BACKEND=simulator).
+# A failed Polygon call never falls back to it, so a made-up price is never passed off as real
+simulator = MarketSimulator(
+    seed=int(os.getenv("MARKET_SIM_SEED") or 42),
+    tick_seconds=float(os.getenv("MARKET_SIM_TICK_SECONDS") or 0) or None,
+)
+
+if polygon_api_key and os.getenv("MARKET_BACKEND", "polygon") == "polygon":
+    price_backend = PolygonBackend()
+else:
+    price_backend = simulator
+
+
+def set_price_backend(backend) -> None:
+    """
+    Swap the source of prices, e.g. to the simulator for offline load tests.
+
+    A backend provides get_share_price, get_share_prices and is_market_open, and a
+    `cached` flag saying whether its prices should go through price_cache. Cached
+    backends also receive the caller's priority for rate limiting.
+    """
+    global price_backend
+    price_backend = backend
+    price_cache.invalidate()
+
+
+def is_market_open(at: datetime | None = None) -> bool:
+    return price_backend.is_market_open(at)
+
+
+def next_open(at: datetime | None = None) -> datetime:
+    """When the next trading session starts, so schedulers can sleep until then."""
+    return get_market_calendar().next_open(at)
+
+
+def next_close(at: datetime | None = None) -> datetime:
+    """When the current trading session ends, or the next one if the market is closed."""
+    return get_market_calendar().next_close(at)
+
+
+# Trades streamed by the price feed; a price that traded more than PRICE_FEED_MAX_AGE seconds ago is looked up instead
+last_trades = LastTradeBook()
+price_feed: PriceFeed | None = None
+PRICE_FEED_MAX_AGE = float(os.getenv("PRICE_FEED_MAX_AGE") or 15)
+# Playback speed of PRICE_FEED_REPLAY relative to its recorded timestamps
+PRICE_FEED_REPLAY_SPEED = float(os.getenv("PRICE_FEED_REPLAY_SPEED") or 1.0)
+
+
+def start_price_feed(feed: PriceFeed | None = None) -> PriceFeed | None:
+    """
+    Start streaming trades into last_trades, following the symbols held across accounts.
+
+    Without a feed, replays PRICE_FEED_REPLAY if that is set, or streams from Polygon's
+    websocket on the realtime plan; otherwise there is nothing to stream and None is returned.
+    """
+    global price_feed
+    if feed is None:
+        if os.getenv("PRICE_FEED_REPLAY"):
+            feed = ReplayFeed(last_trades, os.getenv("PRICE_FEED_REPLAY"), speed=PRICE_FEED_REPLAY_SPEED, loop=True,
+                              symbols_source=read_held_symbols)
+        elif is_realtime_polygon and polygon_api_key:
+            feed = PolygonWebSocketFeed(last_trades, polygon_api_key, symbols_source=read_held_symbols)
+        else:
+            return None
+    if price_feed is not None:
+        price_feed.stop()
+    price_feed = feed
+    feed.start()
+    return feed
+
+
+def stop_price_feed() -> None:
+    global price_feed
+    if price_feed is not None:
+        price_feed.stop()
+        price_feed = None
+
+
+def _streamed_prices(symbols) -> dict[str, float]:
+    """Fresh prices from the last-trade book; symbols without one are subscribed for next time."""
+    feed = price_feed
+    if feed is None:
+        return {}
+    prices = {symbol: price for symbol in symbols if (price := last_trades.get(symbol, PRICE_FEED_MAX_AGE)) is not None}
+    feed.subscribe(symbol for symbol in symbols if symbol not in prices)
+    return prices
+
+
+def _fallback_prices(symbols: list[str], error: Exception) -> dict[str, float]:
+    """
+    Prices to use when the backend failed: the last known price for each symbol.
+
+    Raises ValueError if any symbol has never been priced, rather than trading or
+    valuing it at a made-up price. Warnings go to stderr, since stdout carries the
+    stdio MCP transport.
+    """
+    prices = {symbol: price for symbol in symbols if (price := price_cache.get_stale(symbol)) is not None}
+    missing = [symbol for symbol in symbols if symbol not in prices]
+    if missing:
+        raise ValueError(f"No price available for {', '.join(missing)}: {error}")
+    print(f"Using last known prices for {', '.join(prices)} because {error}", file=sys.stderr)
+    return prices
+
+
+def get_share_price(symbol, priority: int = PRIORITY_TRADE) -> float:
+    streamed = _streamed_prices([symbol])
+    if streamed:
+        return streamed[symbol]
+    backend = price_backend
+    if not backend.cached:
+        return backend.get_share_price(symbol)
+    price = price_cache.get(symbol)
+    if price is not None:
+        return price
+    try:
+        price = backend.get_share_price(symbol, priority)
+    except Exception as e:
+        return _fallback_prices([symbol], e)[symbol]
+    price_cache.put(symbol, price)
+    return price
+
+
+def get_share_prices(symbols, priority: int = PRIORITY_VALUATION) -> dict[str, float]:
+    """
+    Look up many symbols at once: one cache pass, then a single backend request for the misses.
+
+    Args:
+        symbols: The symbols to price; duplicates are looked up once
+        priority: PRIORITY_TRADE or PRIORITY_VALUATION, used when Polygon calls are rate limited
+
+    Returns:
+        dict: symbol -> price
+    """
+    symbols = list(dict.fromkeys(symbols))
+    prices = _streamed_prices(symbols)
+    symbols = [symbol for symbol in symbols if symbol not in prices]
+    backend = price_backend
+    if not backend.cached:
+        return prices | backend.get_share_prices(symbols) if symbols else prices
+    missing = []
+    for symbol in symbols:
+        price = price_cache.get(symbol)
+        if price is None:
+            missing.append(symbol)
+        else:
+            prices[symbol] = price
+    if missing:
         try:
-            return get_share_price_polygon(symbol)
+            fetched = backend.get_share_prices(missing, priority)
         except Exception as e:
-            print(f"Was not able to use the polygon API due to {e}; using a random number")
-    return float(random.randint(1, 100))
+            fetched = _fallback_prices(missing, e)
+        else:
+            price_cache.put_many(fetched)
+            # Like the end-of-day prices, a ticker the snapshot does not know is priced 0.0
+            fetched.update({symbol: 0.0 for symbol in missing if symbol not in fetched})
+        prices.update(fetched)
+    return prices
@@ -0,0 +1,86 @@
+"""
+Trading sessions for the US stock market, answered locally.
+
+Regular sessions run 9:30-16:00 New York time on weekdays. Holidays and early
+closes come from Polygon's upcoming market holidays, fetched once a day by
+market.get_market_calendar(), so checking whether the market is open needs no
+API call.
+"""
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+EASTERN = ZoneInfo("America/New_York")
+REGULAR_OPEN = time(9, 30)
+REGULAR_CLOSE = time(16, 0)
+
+# Longer than any run of weekends and holidays, so a search for the next session always ends
+MAX_CLOSED_DAYS = 10
+
+
+class MarketCalendar:
+    """
+    Session times for any date, given the exchange's holidays.
+
+    Args:
+        closed: Dates the market is closed all day
+        early_closes: Dates the market closes early, mapped to the closing time
+    """
+
+    def __init__(self, closed: set[date] | None = None, early_closes: dict[date, datetime] | None = None):
+        self.closed = closed or set()
+        self.early_closes = early_closes or {}
+
+    @classmethod
+    def from_polygon_holidays(cls, holidays, exchange: str = "NYSE") -> "MarketCalendar":
+        """Build a calendar from Polygon MarketHoliday results for one exchange."""
+        closed = set()
+        early_closes = {}
+        for holiday in holidays:
+            if holiday.exchange != exchange:
+                continue
+            day = date.fromisoformat(holiday.date)
+            if holiday.status == "early-close" and holiday.close:
+                early_closes[day] = datetime.fromisoformat(holiday.close.replace("Z", "+00:00")).astimezone(EASTERN)
+            else:
+                closed.add(day)
+        return cls(closed, early_closes)
+
+    def session(self, day: date) -> tuple[datetime, datetime] | None:
+        """Return the (open, close) of the session on day, or None if the market is closed."""
+        if day.weekday() >= 5 or day in self.closed:
+            return None
+        open_at = datetime.combine(day, REGULAR_OPEN, tzinfo=EASTERN)
+        close_at = self.early_closes.get(day) or datetime.combine(day, REGULAR_CLOSE, tzinfo=EASTERN)
+        return open_at, close_at
+
+    def is_open(self, at: datetime | None = None) -> bool:
+        at = _eastern(at)
+        session = self.session(at.date())
+        return session is not None and session[0] <= at < session[1]
+
+    def next_open(self, at: datetime | None = None) -> datetime:
+        """The start of the first session opening after at."""
+        at = _eastern(at)
+        for offset in range(MAX_CLOSED_DAYS + 1):
+            session = self.session(at.date() + timedelta(days=offset))
+            if session is not None and session[0] > at:
+                return session[0]
+        raise ValueError(f"No market session within {MAX_CLOSED_DAYS} days of {at}")
+
+    def next_close(self, at: datetime | None = None) -> datetime:
+        """The end of the session in progress at at, or of the next session if the market is closed."""
+        at = _eastern(at)
+        for offset in range(MAX_CLOSED_DAYS + 1):
+            session = self.session(at.date() + timedelta(days=offset))
+            if session is not None and session[1] > at:
+                return session[1]
+        raise ValueError(f"No market session within {MAX_CLOSED_DAYS} days of {at}")
+
+
+def _eastern(at: datetime | None) -> datetime:
+    if at is None:
+        return datetime.now(EASTERN)
+    if at.tzinfo is None:
+        # Naive times are taken as local time, as datetime.now() would return them
+        at = at.astimezone()
+    return at.astimezone(EASTERN)
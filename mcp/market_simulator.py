@@ -0,0 +1,100 @@
+"""
+A deterministic, offline stand-in for the Polygon price functions.
+
+Every symbol follows its own geometric Brownian motion path. The path is seeded
+from the simulator seed and the symbol name, so the same seed always produces
+the same prices no matter which symbols are asked for first. Steps are drawn in
+NumPy blocks, and a simulated clock decides which step a lookup reads.
+"""
+import hashlib
+import threading
+import time
+import numpy as np
+
+# Seconds in a trading year (252 sessions of 6.5 hours), used to scale drift and volatility
+TRADING_YEAR_SECONDS = 252 * 6.5 * 3600
+
+
+class MarketSimulator:
+    """
+    Simulated prices with the same interface as the Polygon lookups in market.py.
+
+    Args:
+        seed: Seed shared by every symbol's path
+        drift: Annualized drift of each path
+        volatility: Annualized volatility of each path
+        step_seconds: Simulated market time covered by one step
+        tick_seconds: Wall-clock seconds per step, or None to move only when advance() is called
+        block_size: Number of steps generated at a time for a symbol
+    """
+
+    cached = False
+
+    def __init__(self, seed: int = 42, drift: float = 0.05, volatility: float = 0.2, step_seconds: float = 60.0,
+                 tick_seconds: float | None = None, block_size: int = 4096):
+        self.seed = seed
+        self.drift = drift
+        self.volatility = volatility
+        self.step_seconds = step_seconds
+        self.tick_seconds = tick_seconds
+        self.block_size = block_size
+        self._offset = 0
+        self._started = time.monotonic()
+        self._paths: dict[str, np.ndarray] = {}
+        self._generators: dict[str, np.random.Generator] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def step(self) -> int:
+        """The current position of the simulated clock."""
+        if self.tick_seconds:
+            return self._offset + int((time.monotonic() - self._started) / self.tick_seconds)
+        return self._offset
+
+    def advance(self, steps: int = 1) -> int:
+        """Move the simulated clock forward and return the new step."""
+        self._offset += steps
+        return self.step
+
+    def _start(self, symbol: str) -> tuple[np.random.Generator, float]:
+        digest = hashlib.sha256(symbol.encode()).digest()
+        generator = np.random.default_rng([self.seed, int.from_bytes(digest[:8], "little")])
+        initial_price = float(generator.uniform(10, 500))
+        return generator, initial_price
+
+    def _path(self, symbol: str, step: int) -> np.ndarray:
+        """Return the symbol's price path, generating blocks until it covers step."""
+        path = self._paths.get(symbol)
+        if path is not None and step < len(path):
+            return path
+        with self._lock:
+            path = self._paths.get(symbol)
+            if path is None:
+                generator, initial_price = self._start(symbol)
+                self._generators[symbol] = generator
+                path = np.array([initial_price])
+            if step >= len(path):
+                dt = self.step_seconds / TRADING_YEAR_SECONDS
+                blocks = -(-(step + 1 - len(path)) // self.block_size)
+                shocks = self._generators[symbol].standard_normal(blocks * self.block_size)
+                log_returns = (self.drift - 0.5 * self.volatility ** 2) * dt + self.volatility * np.sqrt(dt) * shocks
+                path = np.concatenate([path, path[-1] * np.exp(np.cumsum(log_returns))])
+            self._paths[symbol] = path
+            return path
+
+    def get_share_price(self, symbol: str) -> float:
+        step = self.step
+        return round(float(self._path(symbol, step)[step]), 2)
+
+    def prices_for(self, symbols) -> np.ndarray:
+        """Return the current prices for symbols as a float64 array."""
+        step = self.step
+        return np.round(np.array([self._path(symbol, step)[step] for symbol in symbols], dtype=np.float64), 2)
+
+    def get_share_prices(self, symbols) -> dict[str, float]:
+        symbols = list(dict.fromkeys(symbols))
+        return dict(zip(symbols, self.prices_for(symbols).tolist()))
+
+    def is_market_open(self, at=None) -> bool:
+        # The simulated market never closes
+        return True
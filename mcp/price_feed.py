@@ -0,0 +1,214 @@
+"""
+Streaming trade prices into an in-memory last-trade book.
+
+A feed runs on a background thread and pushes every trade it receives into a
+LastTradeBook, which get_share_price can read without any I/O. Feeds track
+which symbols they are subscribed to; PolygonWebSocketFeed streams live trades
+and ReplayFeed plays back a recorded file as a stand-in.
+"""
+import asyncio
+import csv
+from abc import ABC, abstractmethod
+import threading
+import time
+from datetime import datetime
+
+
+class LastTradeBook:
+    """The latest trade price per symbol, with when it traded and when we received it."""
+
+    def __init__(self):
+        self._trades: dict[str, tuple[float, float, float]] = {}
+        self._lock = threading.Lock()
+
+    def update(self, symbol: str, price: float, traded_at: float | None = None) -> None:
+        now = time.time()
+        with self._lock:
+            self._trades[symbol] = (price, traded_at or now, now)
+
+    def get(self, symbol: str, max_age: float | None = None) -> float | None:
+        """Return the last price for symbol, or None if it has not traded within max_age seconds."""
+        entry = self._trades.get(symbol)
+        if entry is None or (max_age is not None and time.time() - entry[1] > max_age):
+            return None
+        return entry[0]
+
+    def quote(self, symbol: str) -> dict | None:
+        """Return the last price with its staleness metadata, or None if the symbol has not traded."""
+        entry = self._trades.get(symbol)
+        if entry is None:
+            return None
+        price, traded_at, received_at = entry
+        return {"symbol": symbol, "price": price, "traded_at": traded_at, "received_at": received_at,
+                "age": time.time() - traded_at}
+
+    def symbols(self) -> list[str]:
+        with self._lock:
+            return list(self._trades)
+
+
+class PriceFeed(ABC):
+    """
+    Base class for feeds: owns the consumer thread and the set of subscribed symbols.
+
+    Args:
+        book: Where received trades are written
+        symbols_source: Optional callable returning the symbols to follow, e.g. those held across accounts
+        resync_interval: Seconds between calls to symbols_source while the feed runs
+    """
+
+    def __init__(self, book: LastTradeBook, symbols_source=None, resync_interval: float = 30.0):
+        self.book = book
+        self.symbols_source = symbols_source
+        self.resync_interval = resync_interval
+        self.subscriptions: set[str] = set()
+        self._thread = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stopped.clear()
+            self.sync_subscriptions()
+            self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+            self._thread.start()
+            if self.symbols_source is not None:
+                threading.Thread(target=self._resync, name=f"{type(self).__name__}-resync", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=5)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def subscribe(self, symbols) -> None:
+        with self._lock:
+            new = set(symbols) - self.subscriptions
+            self.subscriptions |= new
+        if new:
+            self._on_subscribe(new)
+
+    def unsubscribe(self, symbols) -> None:
+        with self._lock:
+            old = set(symbols) & self.subscriptions
+            self.subscriptions -= old
+        if old:
+            self._on_unsubscribe(old)
+
+    def sync_subscriptions(self, symbols=None) -> None:
+        """Follow exactly symbols, or whatever symbols_source returns when symbols is None."""
+        if symbols is None:
+            if self.symbols_source is None:
+                return
+            symbols = self.symbols_source()
+        symbols = set(symbols)
+        self.unsubscribe(self.subscriptions - symbols)
+        self.subscribe(symbols)
+
+    def _resync(self) -> None:
+        while not self._stopped.wait(self.resync_interval):
+            try:
+                self.sync_subscriptions()
+            except Exception as e:
+                print(f"Was not able to refresh price feed subscriptions due to {e}")
+
+    def _on_subscribe(self, symbols: set[str]) -> None:
+        pass
+
+    def _on_unsubscribe(self, symbols: set[str]) -> None:
+        pass
+
+    @abstractmethod
+    def _run(self) -> None:
+        """Receive trades into the book until stop() is called."""
+
+
+class PolygonWebSocketFeed(PriceFeed):
+    """Live trades from Polygon's stocks websocket (T.<symbol> channels)."""
+
+    def __init__(self, book: LastTradeBook, api_key: str, symbols_source=None, resync_interval: float = 30.0):
+        from polygon import WebSocketClient
+        super().__init__(book, symbols_source, resync_interval)
+        self._client = WebSocketClient(api_key=api_key, market="stocks")
+        self._loop = None
+
+    def _on_subscribe(self, symbols: set[str]) -> None:
+        self._client.subscribe(*(f"T.{symbol}" for symbol in symbols))
+
+    def _on_unsubscribe(self, symbols: set[str]) -> None:
+        self._client.unsubscribe(*(f"T.{symbol}" for symbol in symbols))
+
+    async def _handle(self, messages) -> None:
+        for message in messages:
+            if getattr(message, "price", None) is not None:
+                self.book.update(message.symbol, message.price, message.timestamp / 1000 if message.timestamp else None)
+
+    def _run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._client.connect(self._handle))
+        except Exception as e:
+            print(f"Polygon price feed stopped due to {e}")
+        finally:
+            self._loop.close()
+            self._loop = None
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._client.close(), self._loop)
+        super().stop()
+
+
+class ReplayFeed(PriceFeed):
+    """
+    Plays back recorded trades from a CSV file with columns timestamp, symbol, price.
+
+    Each trade is stamped with the time it is replayed at, so the book judges its
+    freshness as if it had just traded live.
+
+    Args:
+        path: The file to replay; timestamps are epoch seconds or ISO 8601
+        speed: Playback speed relative to the recorded timestamps, or None to replay as fast as possible
+        loop: Start again from the top when the file ends, after LOOP_PAUSE seconds; only paced replays loop
+    """
+
+    LOOP_PAUSE = 1.0
+
+    def __init__(self, book: LastTradeBook, path: str, speed: float | None = 1.0, loop: bool = False,
+                 symbols_source=None, resync_interval: float = 30.0):
+        super().__init__(book, symbols_source, resync_interval)
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+
+    @staticmethod
+    def _timestamp(value: str) -> float:
+        try:
+            return float(value)
+        except ValueError:
+            return datetime.fromisoformat(value).timestamp()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            first = None
+            started = time.monotonic()
+            with open(self.path, newline="") as f:
+                for row in csv.DictReader(f):
+                    if self._stopped.is_set():
+                        return
+                    if self.speed:
+                        recorded_at = self._timestamp(row["timestamp"])
+                        first = recorded_at if first is None else first
+                        delay = (recorded_at - first) / self.speed - (time.monotonic() - started)
+                        if delay > 0 and self._stopped.wait(delay):
+                            return
+                    symbol = row["symbol"]
+                    if symbol in self.subscriptions:
+                        self.book.update(symbol, float(row["price"]))
+            if not (self.loop and self.speed) or self._stopped.wait(self.LOOP_PAUSE):
+                return
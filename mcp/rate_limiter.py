@@ -0,0 +1,128 @@
+"""
+Token-bucket rate limiting for outbound API calls, shared by every thread in the process.
+
+Each endpoint has its own bucket, and an optional total bucket caps all endpoints
+together, as an API key's quota does. Callers that have to wait for a token queue
+up by priority (lower numbers first, then in arrival order), so an urgent call
+is never stuck behind a backlog of less important ones.
+"""
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+
+
+class TokenBucket:
+    """Holds up to capacity tokens, refilled continuously at rate tokens per second."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Seconds until a whole token is available."""
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    """
+    Per-endpoint token buckets with a priority queue of waiters.
+
+    Args:
+        rate: Default tokens per second for an endpoint
+        capacity: Default burst size for an endpoint
+        limits: Optional endpoint -> (rate, capacity) overrides
+        total: Optional (rate, capacity) of a bucket every call draws from as well as its endpoint's
+    """
+
+    def __init__(self, rate: float, capacity: float, limits: dict[str, tuple[float, float]] | None = None,
+                 total: tuple[float, float] | None = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.limits = limits or {}
+        self.granted = 0
+        self.rejected = 0
+        self._buckets: dict[str, TokenBucket] = {}
+        self._waiters: dict[str, list] = {}
+        # Waiters across all endpoints, in the same order as each endpoint's queue, so the
+        # head of this queue is always also at the head of its endpoint's
+        self._total = TokenBucket(*total) if total else None
+        self._total_waiters: list = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def _bucket(self, endpoint: str) -> TokenBucket:
+        bucket = self._buckets.get(endpoint)
+        if bucket is None:
+            bucket = self._buckets[endpoint] = TokenBucket(*self.limits.get(endpoint, (self.rate, self.capacity)))
+            self._waiters[endpoint] = []
+        return bucket
+
+    def acquire(self, endpoint: str, priority: int = 0, timeout: float | None = None) -> bool:
+        """
+        Take a token for endpoint, waiting behind higher-priority callers if needed.
+
+        Args:
+            endpoint: The bucket to draw from
+            priority: Lower numbers are served first
+            timeout: Longest time to wait, or None to wait indefinitely; 0 never waits
+
+        Returns:
+            bool: True if a token was taken, False if the timeout ran out first
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            buckets = [self._bucket(endpoint)]
+            queues = [self._waiters[endpoint]]
+            if self._total is not None:
+                buckets.append(self._total)
+                queues.append(self._total_waiters)
+            ticket = (priority, next(self._sequence))
+            for waiters in queues:
+                heapq.heappush(waiters, ticket)
+            while True:
+                now = time.monotonic()
+                for bucket in buckets:
+                    bucket.refill(now)
+                first = all(waiters[0] == ticket for waiters in queues)
+                if first and all(bucket.tokens >= 1 for bucket in buckets):
+                    for waiters in queues:
+                        heapq.heappop(waiters)
+                    for bucket in buckets:
+                        bucket.tokens -= 1
+                    self.granted += 1
+                    self._condition.notify_all()
+                    return True
+                if deadline is not None and now >= deadline:
+                    for waiters in queues:
+                        waiters.remove(ticket)
+                        heapq.heapify(waiters)
+                    self.rejected += 1
+                    self._condition.notify_all()
+                    return False
+                wait = max(bucket.wait_time() for bucket in buckets) if first else None
+                if deadline is not None:
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self._condition.wait(wait)
+
+    async def acquire_async(self, endpoint: str, priority: int = 0, timeout: float | None = None) -> bool:
+        """Like acquire, but waits without blocking the event loop."""
+        return await asyncio.to_thread(self.acquire, endpoint, priority, timeout)
+
+    def stats(self) -> dict:
+        with self._condition:
+            stats = {
+                "granted": self.granted,
+                "rejected": self.rejected,
+                "tokens": {endpoint: round(bucket.tokens, 2) for endpoint, bucket in self._buckets.items()},
+            }
+            if self._total is not None:
+                stats["total_tokens"] = round(self._total.tokens, 2)
+            return stats
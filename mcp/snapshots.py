@@ -0,0 +1,84 @@
+"""
+Memory-mapped columnar snapshots of a day's closing prices.
+
+Each date is stored as two .npy files: a sorted symbol column and a float64
+close column in the same order. Opening a snapshot maps the files instead of
+parsing them, and symbol lookups are binary searches over the mapped column.
+"""
+import os
+from contextlib import contextmanager
+import numpy as np
+
+_snapshot_dir = os.path.dirname(os.path.abspath(__file__))
+SNAPSHOT_DIR = os.getenv("MARKET_SNAPSHOT_DIR") or os.path.join(_snapshot_dir, "market_snapshots")
+
+
+@contextmanager
+def atomic_open(path: str):
+    """
+    Open path for binary writing under a temporary name and move it into place on success,
+    so a concurrent reader sees either the old file or the complete new one, never a partial one.
+    """
+    with open(path + ".tmp", "wb") as f:
+        yield f
+    os.replace(path + ".tmp", path)
+
+
+def _paths(date: str) -> tuple[str, str]:
+    return (os.path.join(SNAPSHOT_DIR, f"{date}.symbols.npy"), os.path.join(SNAPSHOT_DIR, f"{date}.closes.npy"))
+
+
+class MarketSnapshot:
+    """Closing prices for one date, looked up by symbol."""
+
+    def __init__(self, symbols: np.ndarray, closes: np.ndarray):
+        self.symbols = symbols
+        self.closes = closes
+
+    @classmethod
+    def open(cls, date: str) -> "MarketSnapshot | None":
+        """Map the snapshot for date, or return None if it has not been written."""
+        symbols_path, closes_path = _paths(date)
+        if not (os.path.exists(symbols_path) and os.path.exists(closes_path)):
+            return None
+        return cls(np.load(symbols_path, mmap_mode="r"), np.load(closes_path, mmap_mode="r"))
+
+    @classmethod
+    def write(cls, date: str, data: dict[str, float]) -> "MarketSnapshot":
+        """Write data (symbol -> close) as the snapshot for date and return it mapped."""
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        data = {symbol: close for symbol, close in data.items() if close is not None}
+        symbols = np.array(sorted(data), dtype=str)
+        closes = np.array([data[symbol] for symbol in symbols], dtype=np.float64)
+        for path, column in zip(_paths(date), (symbols, closes)):
+            with atomic_open(path) as f:
+                np.save(f, column)
+        return cls.open(date)
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    def __contains__(self, symbol: str) -> bool:
+        return self._index(symbol) is not None
+
+    def _index(self, symbol: str) -> int | None:
+        i = int(np.searchsorted(self.symbols, symbol))
+        if i < len(self.symbols) and self.symbols[i] == symbol:
+            return i
+        return None
+
+    def get(self, symbol: str, default: float | None = None) -> float | None:
+        i = self._index(symbol)
+        return float(self.closes[i]) if i is not None else default
+
+    def prices_for(self, symbols) -> np.ndarray:
+        """Return the closes for symbols as a float64 array, with NaN for unknown symbols."""
+        wanted = np.asarray(symbols, dtype=str)
+        if not len(self.symbols):
+            return np.full(wanted.shape, np.nan)
+        idx = np.searchsorted(self.symbols, wanted).clip(max=len(self.symbols) - 1)
+        found = self.symbols[idx] == wanted
+        return np.where(found, self.closes[idx], np.nan)
+
+    def to_dict(self) -> dict[str, float]:
+        return dict(zip(self.symbols.tolist(), self.closes.tolist()))